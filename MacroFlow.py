@@ -5,18 +5,143 @@ import os
 import sys
 import time
 import json
+import hashlib
+import zipfile
+import struct
+import zlib
+import ctypes
 import threading
 import logging
+import logging.handlers
+import queue
+import atexit
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Sequence
+from contextlib import contextmanager
 from datetime import datetime
-from math import floor
+from functools import lru_cache
+from math import ceil, floor
 
-import pyautogui
-from pynput import mouse, keyboard
-from PIL import Image, ImageGrab
-import numpy as np
-import cv2
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+# -----------------------
+# Startup timing & lazy imports
+# -----------------------
+class StartupTimer:
+    """Per-phase breakdown of startup time, logged once the app is up"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.last = self.t0
+        self.phases = []
+        self.nested = 0.0
+        self.reported = False
+
+    def mark(self, phase):
+        """Close the current phase; lazy imports inside it are listed separately"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last - self.nested))
+        self.last = now
+        self.nested = 0.0
+
+    def add(self, phase, seconds):
+        """Record a phase measured elsewhere (a lazy import)"""
+        if self.reported:
+            logging.info(f"Lazy {phase}: {seconds * 1000.0:.0f} ms")
+            return
+        self.phases.append((phase, seconds))
+        self.nested += seconds
+
+    def report(self, phase=None):
+        if phase:
+            self.mark(phase)
+        total = (time.perf_counter() - self.t0) * 1000.0
+        parts = ", ".join(f"{name}={dt * 1000.0:.0f} ms" for name, dt in self.phases)
+        logging.info(f"Startup: {total:.0f} ms ({parts})")
+        self.reported = True
+
+STARTUP_TIMER = StartupTimer()
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    `loader` imports the module with a plain import statement so that
+    Nuitka/onefile builds can still see and bundle the dependency.
+    """
+
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                t = time.perf_counter()
+                module = self._loader()
+                STARTUP_TIMER.add(f"import {self._name}", time.perf_counter() - t)
+                self._module = module
+        return self._module
+
+    def __getattr__(self, item):
+        module = self._module
+        if module is None:
+            module = self._load()
+        return getattr(module, item)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def _load_pyautogui():
+    """Import pyautogui and apply our tweaks"""
+    import pyautogui
+    pyautogui.FAILSAFE = False
+    pyautogui.MINIMUM_DURATION = 0
+    pyautogui.MINIMUM_SLEEP = 0.005
+    return pyautogui
+
+def _load_mouse():
+    from pynput import mouse
+    return mouse
+
+def _load_keyboard():
+    from pynput import keyboard
+    return keyboard
+
+def _load_image():
+    from PIL import Image
+    return Image
+
+def _load_imagegrab():
+    from PIL import ImageGrab
+    return ImageGrab
+
+def _load_numpy():
+    import numpy
+    return numpy
+
+def _load_cv2():
+    import cv2
+    return cv2
+
+# Heavy dependencies load on first use; cv2 alone is most of the cold start
+pyautogui = LazyModule("pyautogui", _load_pyautogui)
+mouse = LazyModule("pynput.mouse", _load_mouse)
+keyboard = LazyModule("pynput.keyboard", _load_keyboard)
+Image = LazyModule("PIL.Image", _load_image)
+ImageGrab = LazyModule("PIL.ImageGrab", _load_imagegrab)
+np = LazyModule("numpy", _load_numpy)
+cv2 = LazyModule("cv2", _load_cv2)
+
+# tkinter is imported when the GUI starts
+tk = ttk = filedialog = messagebox = scrolledtext = None
+
+def load_gui_modules():
+    """Import tkinter into the module namespace"""
+    global tk, ttk, filedialog, messagebox, scrolledtext
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox, scrolledtext
 
 # -----------------------
 # Fix dla AppImage/OneFile - DODANE NA SAMYM POCZĄTKU
@@ -66,15 +191,91 @@ TEMPLATE_DIR = PATHS["template_dir"]
 APP_DATA_DIR = PATHS["app_data_dir"]
 DEFAULT_TEMPLATE_SIZE = 40
 TEMPLATE_MATCH_THRESH = 0.70
-RETRY_RADII = [10, 30, 60, 120]
+# Locality-first template search: radii start at the template size (at least
+# SEARCH_BASE_RADIUS) and grow by SEARCH_GROWTH; full screen is tried last.
+# Set RETRY_RADII (or an event's "search_radii") to a list to override.
+RETRY_RADII = None
+SEARCH_BASE_RADIUS = 24
+SEARCH_GROWTH = 2.0
+SEARCH_MAX_RADIUS = 600
+
+# Max age (seconds) of the shared screen frame used by all locators
+FRAME_TTL = 0.03
+
+# Screen capture backend for the shared frame: "pil" (ImageGrab), or "xshm"
+# to grab into a reused X11 MIT-SHM buffer (Linux/X11, libXext), or "xwd" to
+# map the XWD framebuffer file of an Xvfb started with -fbdir DIR
+CAPTURE_BACKEND = "pil"
+
+# Framebuffer file for the "xwd" backend: DIR/Xvfb_screen0 for screen 0
+XWD_FRAMEBUFFER = None
+
+# Memory cap for decoded templates kept by TEMPLATE_CACHE
+TEMPLATE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Coarse-to-fine matching: large searches run first on a downscaled screen
+# (up to PYRAMID_MAX_LEVELS halvings, keeping the template at least
+# PYRAMID_MIN_TEMPLATE px), then refine in a small full-resolution window.
+PYRAMID_MATCHING = True
+PYRAMID_MAX_LEVELS = 3
+PYRAMID_MIN_TEMPLATE = 12
+PYRAMID_MIN_SEARCH_RATIO = 64   # search area / template area below this -> plain match
+PYRAMID_COARSE_SLACK = 0.15     # coarse threshold = threshold - slack
+PYRAMID_CANDIDATES = 3
+
+# Opt-in: match on single-channel frames/templates (about 3x less work, but
+# templates that differ only in colour can no longer be told apart). While
+# on, "match_color": true on an event (or inline template) keeps it in colour.
+GRAYSCALE_MATCHING = False
 
 # Sampling interval for drag (seconds)
 SAMPLE_INTERVAL = 0.01
 
-# pyautogui tweaks
-pyautogui.FAILSAFE = False
-pyautogui.MINIMUM_DURATION = 0
-pyautogui.MINIMUM_SLEEP = 0.005
+# Initial capacity (samples) of a drag recording buffer; it doubles when full
+SAMPLE_BUFFER_CAPACITY = 256
+
+# Playback waits busy-spin for this final slice (seconds) to hit deadlines
+SCHEDULER_SPIN = 0.002
+
+# Drag moves are split into steps of at most this long (seconds); Stop is
+# checked between steps
+CANCEL_SLICE = 0.02
+
+# Measured per-call input cost (see calibrate_input), kept per backend.
+# Drag replay and runtime projections compensate for it. Calibration only
+# runs on request; until then input counts as free.
+INPUT_PROFILE_FILE = os.path.join(APP_DATA_DIR, "input_profile.json")
+INPUT_CALIBRATION_CALLS = 30
+
+# Input injection backend: "pyautogui", or "xtest" to send events straight
+# through the X Test extension (Linux/X11, needs python-xlib)
+INPUT_BACKEND = "pyautogui"
+
+# Logging: records go through a bounded queue to a background writer
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+LOG_QUEUE_SIZE = 10000
+LOG_RATE_LIMIT = 20  # records per second per call site, SAMPLE_LOG only
+
+# How often (ms) the Tk thread applies updates posted by worker threads
+UI_BUS_INTERVAL_MS = 50
+
+# Lines kept in the on-screen log (the log file keeps everything)
+LOG_VIEW_MAX_LINES = 2000
+
+# zlib-compress sample columns in .mfb files (smaller, but not memory-mapped)
+MFB_COMPRESSION = False
+
+# Seconds the app waits on exit for background saves to finish
+SAVE_WAIT_TIMEOUT = 30
+
+# Streaming recording: finished events are appended to a journal on disk
+# (fsync every JOURNAL_FSYNC_INTERVAL s), only the newest JOURNAL_TAIL_EVENTS
+# stay in memory, and the journal is compacted to .mfb when recording stops
+JOURNAL_RECORDING = False
+JOURNAL_FSYNC_INTERVAL = 1.0
+JOURNAL_TAIL_EVENTS = 500
+JOURNAL_DIR = os.path.join(APP_DATA_DIR, "journal")
 
 # -----------------------
 # Color Scheme - Minimal Dark
@@ -95,6 +296,83 @@ COLORS = {
 # -----------------------
 # Logging z poprawioną ścieżką
 # -----------------------
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site: at most `rate` records/s, bursts of `burst`.
+
+    Suppressed records are counted and reported on the next one let through.
+    """
+
+    def __init__(self, rate=LOG_RATE_LIMIT, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self._lock = threading.Lock()
+        self._buckets = {}  # (pathname, lineno) -> [tokens, last_time, suppressed]
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: records are dropped when the
+    queue is full and the count is appended to the next record that fits."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        dropped = self.dropped
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} earlier log records dropped]"
+        try:
+            self.queue.put_nowait(record)
+            self.dropped -= dropped
+        except queue.Full:
+            self.dropped += 1
+
+# Per-sample call sites (pointer sampling, listener callbacks) log through this
+# child logger so a failing sample can't flood the queue; everything else
+# reaches the file log unfiltered
+SAMPLE_LOG = logging.getLogger("macroflow.samples")
+SAMPLE_LOG.addFilter(RateLimitFilter())
+
+LOG_LISTENER = None
+
+def start_log_listener(handlers):
+    """Route the root logger through a bounded queue; `handlers` run on the listener thread"""
+    global LOG_LISTENER
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    LOG_LISTENER = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    LOG_LISTENER.start()
+    atexit.register(stop_log_listener)
+
+def stop_log_listener():
+    """Flush queued records and stop the listener thread"""
+    global LOG_LISTENER
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
 def setup_logging():
     """Konfiguruj logowanie z obsługą błędów"""
     try:
@@ -103,23 +381,23 @@ def setup_logging():
         if log_dir and not os.path.exists(log_dir):
             os.makedirs(log_dir, exist_ok=True)
         
-        # Konfiguruj logging
-        logging.basicConfig(
-            filename=LOG_FILE, 
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-            filemode='a'  # Append zamiast write
-        )
+        # Konfiguruj logging: plik z rotacją, zapis w osobnym wątku
+        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        handlers = [file_handler]
         
         # Dodaj też handler konsoli dla AppImage
         if PATHS["is_appimage"]:
             console_handler = logging.StreamHandler()
             console_handler.setLevel(logging.INFO)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
             console_handler.setFormatter(formatter)
-            logging.getLogger().addHandler(console_handler)
+            handlers.append(console_handler)
             print(f"AppImage mode: Logging to {LOG_FILE}")
         
+        start_log_listener(handlers)
+        
         logging.info("=== MacroFlow Mini start ===")
         logging.info(f"AppImage mode: {PATHS['is_appimage']}")
         logging.info(f"Data directory: {APP_DATA_DIR}")
@@ -131,13 +409,691 @@ def setup_logging():
         print(f"Log setup error: {e}")
         print(f"Using fallback logging to console")
 
-# Uruchom setup logowania
-setup_logging()
+# -----------------------
+# Drag sample storage
+# -----------------------
+class SampleBuffer:
+    """Growable (x, y, t) columns for recording drag paths.
+
+    Columns are preallocated array('i')/array('d') blocks that double when
+    full, so a mouse-move callback stores 16 bytes instead of a dict.
+    `view()` snapshots the samples for an event.
+    """
+
+    def __init__(self, capacity=SAMPLE_BUFFER_CAPACITY):
+        self._lock = threading.Lock()
+        self._x = array('i', [0]) * capacity
+        self._y = array('i', [0]) * capacity
+        self._t = array('d', [0.0]) * capacity
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def append(self, x, y, t):
+        with self._lock:
+            n = self._n
+            if n == len(self._x):
+                extra = max(n, SAMPLE_BUFFER_CAPACITY)
+                self._x.extend(array('i', [0]) * extra)
+                self._y.extend(array('i', [0]) * extra)
+                self._t.extend(array('d', [0.0]) * extra)
+            self._x[n] = int(x)
+            self._y[n] = int(y)
+            self._t[n] = t
+            self._n = n + 1
+
+    def clear(self):
+        """Forget the samples but keep the allocated columns"""
+        with self._lock:
+            self._n = 0
+
+    def nbytes(self):
+        """Allocated size of the columns in bytes"""
+        return (len(self._x) * self._x.itemsize + len(self._y) * self._y.itemsize
+                + len(self._t) * self._t.itemsize)
+
+    def view(self, style="b"):
+        """Immutable SampleView of the samples recorded so far.
+
+        Style "b" stores time deltas ({"x", "y", "dt"} samples), style "a"
+        keeps absolute times ({"pos", "timestamp"} samples).
+        """
+        with self._lock:
+            n = self._n
+            xs, ys, ts = self._x[:n], self._y[:n], self._t[:n]
+        if style == "b" and n:
+            t = np.frombuffer(ts, dtype=np.float64)
+            dt = np.empty_like(t)
+            dt[0] = 0.0
+            np.subtract(t[1:], t[:-1], out=dt[1:])
+            ts = array('d', dt.tobytes())
+        return SampleView(xs, ys, ts, style)
+
+class SampleView(Sequence):
+    """Read-only drag samples kept as columns.
+
+    Indexing yields the same dicts the JSON format uses, so code written for
+    lists of sample dicts keeps working; `json_default` expands it at save.
+    """
+
+    __slots__ = ("xs", "ys", "ts", "style")
+
+    def __init__(self, xs, ys, ts, style="b"):
+        self.xs = xs
+        self.ys = ys
+        self.ts = ts
+        self.style = style
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return SampleView(self.xs[i], self.ys[i], self.ts[i], self.style)
+        # int()/float() also unwrap NumPy scalars from .mfb-backed columns
+        x, y, t = int(self.xs[i]), int(self.ys[i]), float(self.ts[i])
+        if self.style == "a":
+            return {"pos": (x, y), "timestamp": t}
+        return {"x": x, "y": y, "dt": t}
+
+    def __repr__(self):
+        return f"<SampleView {len(self)} samples, style {self.style!r}>"
+
+    def arrays(self):
+        """(x, y, t) as NumPy arrays sharing the view's memory"""
+        return (np.frombuffer(self.xs, dtype=np.intc),
+                np.frombuffer(self.ys, dtype=np.intc),
+                np.frombuffer(self.ts, dtype=np.float64))
+
+    def take(self, indices):
+        """New view holding only the samples at `indices`"""
+        x, y, t = self.arrays()
+        idx = np.asarray(indices, dtype=np.intp)
+        return SampleView(array('i', x[idx].tobytes()), array('i', y[idx].tobytes()),
+                          array('d', t[idx].tobytes()), self.style)
+
+    def dedupe(self):
+        """Drop samples that repeat the previous position"""
+        if len(self) < 2:
+            return self
+        x, y, _ = self.arrays()
+        keep = np.ones(len(x), dtype=bool)
+        keep[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+        return self.take(np.flatnonzero(keep))
+
+    def nbytes(self):
+        return len(self) * (self.xs.itemsize + self.ys.itemsize + self.ts.itemsize)
+
+    def to_list(self):
+        """Samples as a list of dicts (the on-disk form)"""
+        return [self[i] for i in range(len(self))]
+
+def json_default(obj):
+    """`default=` hook for json.dump: expands SampleViews"""
+    if isinstance(obj, SampleView):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# -----------------------
+# Event store
+# -----------------------
+class EventList(list):
+    """List of recorded events with a `version` bumped on every change.
+
+    Views compare (identity, version) to skip work when nothing changed.
+    With a journal attached, appended events also go to disk and only the
+    newest `tail` of them stay in memory.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.version = 0
+        self.journal = None
+        self.tail = None
+
+    def attach_journal(self, journal, tail=JOURNAL_TAIL_EVENTS):
+        self.journal = journal
+        self.tail = tail
+
+    def detach_journal(self):
+        journal, self.journal = self.journal, None
+        return journal
+
+    def append(self, item):
+        super().append(item)
+        self.version += 1
+        journal = self.journal
+        if journal is not None:
+            journal.append(item)
+            if len(self) > self.tail:
+                super().__delitem__(slice(0, len(self) - self.tail))
+
+    def extend(self, items):
+        super().extend(items)
+        self.version += 1
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self.version += 1
+
+    def pop(self, *args):
+        item = super().pop(*args)
+        self.version += 1
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.version += 1
+
+    def reverse(self):
+        super().reverse()
+        self.version += 1
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.version += 1
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.version += 1
+
+    def __iadd__(self, items):
+        super().__iadd__(items)
+        self.version += 1
+        return self
+
+# -----------------------
+# Macro files (JSON / binary)
+# -----------------------
+MFB_MAGIC = b"MFB1"
+MFB_VERSION = 1
+MFB_ALIGN = 64
+MFB_EXTENSION = ".mfb"
+
+# Drag samples live in three shared columns; events point into them
+_MFB_COLUMNS = (("x", "<i4"), ("y", "<i4"), ("t", "<f8"))
+_MFB_SAMPLE_KEYS = {"b": ("x", "y", "dt"), "a": ("pos", "timestamp")}
+_MFB_REF = "__mfb_samples__"
+
+def is_mfb_path(fname):
+    return fname.lower().endswith(MFB_EXTENSION)
+
+def _mfb_align(n):
+    return -(-n // MFB_ALIGN) * MFB_ALIGN
+
+def _is_int32(v):
+    return type(v) is int and -2**31 <= v < 2**31
+
+def _sample_columns(samples):
+    """(style, xs, ys, ts) if `samples` survive a trip through the columns.
+
+    Lists of sample dicts qualify only when every dict has exactly the keys
+    (in order) and value types a SampleView produces, so export is lossless.
+    Anything else stays inline in the header.
+    """
+    if isinstance(samples, SampleView):
+        return (samples.style,) + samples.arrays()
+    if not isinstance(samples, list) or not samples or not isinstance(samples[0], dict):
+        return None
+    keys = tuple(samples[0])
+    style = next((s for s, k in _MFB_SAMPLE_KEYS.items() if k == keys), None)
+    if style is None:
+        return None
+    xs, ys, ts = [], [], []
+    for s in samples:
+        if not isinstance(s, dict) or tuple(s) != keys:
+            return None
+        if style == "b":
+            x, y, t = s["x"], s["y"], s["dt"]
+        else:
+            pos, t = s["pos"], s["timestamp"]
+            if not isinstance(pos, (list, tuple)) or len(pos) != 2:
+                return None
+            x, y = pos
+        if not (_is_int32(x) and _is_int32(y) and type(t) is float):
+            return None
+        xs.append(x)
+        ys.append(y)
+        ts.append(t)
+    return style, xs, ys, ts
+
+def save_mfb(fname, evts, compress=None):
+    """Write events as a binary macro: JSON header + columnar sample arrays.
+
+    Layout: magic, uint32 header length, header JSON, then one 64-byte
+    aligned block per column (x, y as int32, t as float64, little endian).
+    With `compress` the blocks are zlib streams and cannot be memory-mapped.
+    """
+    compress = MFB_COMPRESSION if compress is None else compress
+    parts = {name: [] for name, _ in _MFB_COLUMNS}
+    header_events = []
+    count = 0
+    for e in evts:
+        cols = _sample_columns(e.get("samples"))
+        if cols:
+            style, xs, ys, ts = cols
+            e = dict(e)
+            e["samples"] = {_MFB_REF: [count, len(xs)], "style": style}
+            for (name, dtype), values in zip(_MFB_COLUMNS, (xs, ys, ts)):
+                parts[name].append(np.asarray(values, dtype=dtype))
+            count += len(xs)
+        header_events.append(e)
+
+    columns, blobs, offset = {}, [], 0
+    for name, dtype in _MFB_COLUMNS:
+        arr = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+        data = arr.astype(dtype, copy=False).tobytes()
+        if compress:
+            data = zlib.compress(data, 6)
+        columns[name] = {"dtype": dtype, "length": int(arr.size), "offset": offset,
+                         "nbytes": len(data), "codec": "zlib" if compress else "raw"}
+        blobs.append(data)
+        offset += _mfb_align(len(data))
+
+    header = json.dumps({"version": MFB_VERSION, "samples": count, "columns": columns,
+                         "events": header_events},
+                        default=json_default, separators=(",", ":")).encode("utf-8")
+    with open(fname, "wb") as fh:
+        fh.write(MFB_MAGIC + struct.pack("<I", len(header)) + header)
+        fh.write(b"\0" * (_mfb_align(8 + len(header)) - 8 - len(header)))
+        for data in blobs:
+            fh.write(data)
+            fh.write(b"\0" * (_mfb_align(len(data)) - len(data)))
+
+def load_mfb(fname, mmap=False):
+    """Read a binary macro; drag samples come back as SampleViews.
+
+    With `mmap` uncompressed columns are memory-mapped, so a large recording
+    loads in the time it takes to parse the header. Only read-only callers
+    may ask for that: a mapped file cannot be saved over while in use (SIGBUS
+    on Linux, PermissionError on Windows), so by default columns are copied.
+    """
+    with open(fname, "rb") as fh:
+        head = fh.read(8)
+        if len(head) < 8 or head[:4] != MFB_MAGIC:
+            raise ValueError(f"{fname}: not a MacroFlow binary macro")
+        (hlen,) = struct.unpack("<I", head[4:])
+        header = json.loads(fh.read(hlen).decode("utf-8"))
+        if header.get("version", 0) > MFB_VERSION:
+            raise ValueError(f"{fname}: format version {header.get('version')} is newer than supported")
+        base = _mfb_align(8 + hlen)
+        cols = {}
+        for name, spec in header["columns"].items():
+            dtype, n = np.dtype(spec["dtype"]), spec["length"]
+            if spec["codec"] == "raw" and mmap and n:
+                arr = np.memmap(fname, dtype=dtype, mode="r", offset=base + spec["offset"], shape=(n,))
+            else:
+                fh.seek(base + spec["offset"])
+                data = fh.read(spec["nbytes"])
+                if spec["codec"] == "zlib":
+                    data = zlib.decompress(data)
+                elif spec["codec"] != "raw":
+                    raise ValueError(f"{fname}: unknown column codec {spec['codec']!r}")
+                arr = np.frombuffer(data, dtype=dtype, count=n)
+            cols[name] = arr
+
+    evts = header["events"]
+    for ev in evts:
+        ref = ev.get("samples")
+        if isinstance(ref, dict) and _MFB_REF in ref:
+            start, n = ref[_MFB_REF]
+            end = start + n
+            ev["samples"] = SampleView(cols["x"][start:end], cols["y"][start:end],
+                                       cols["t"][start:end], ref.get("style", "b"))
+    return evts
+
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = ".mfz"
+
+def is_bundle_path(fname):
+    return fname.lower().endswith(BUNDLE_EXTENSION)
+
+def _bundle_template(tpl_info, pngs):
+    """Add an event's template to `pngs` (member -> PNG bytes); return its reference.
+
+    Members are named by the SHA-256 of the pixels, so a template used by
+    many events (or saved from several files) is stored once. Templates
+    that already come from a bundle are copied without re-encoding.
+    """
+    if isinstance(tpl_info, dict) and tpl_info.get("png") and tpl_info.get("bundle"):
+        member = tpl_info["png"]
+        if member not in pngs:
+            with zipfile.ZipFile(tpl_info["bundle"]) as src:
+                pngs[member] = src.read(member)
+    else:
+        bgr = TEMPLATE_CACHE.get(tpl_info, color=True)
+        if bgr is None:
+            return None
+        digest = hashlib.sha256(repr(bgr.shape).encode("ascii") + bgr.tobytes()).hexdigest()
+        member = f"templates/{digest}.png"
+        if member not in pngs:
+            ok, buf = cv2.imencode(".png", bgr)
+            if not ok:
+                return None
+            pngs[member] = buf.tobytes()
+    ref = {"png": member}
+    if isinstance(tpl_info, dict) and tpl_info.get("match_color"):
+        ref["match_color"] = True
+    return ref
+
+def save_bundle(fname, evts):
+    """Write a .mfz bundle: events.json plus deduplicated PNG templates"""
+    pngs = {}
+    export = []
+    for i, e in enumerate(evts):
+        ee = dict(e)
+        tpl = ee.pop("template", None)
+        if tpl:
+            ref = _bundle_template(tpl, pngs)
+            if ref is None:
+                logging.warning(f"Bundle: template of event {i} could not be read, saved without it")
+            ee["template"] = ref
+        export.append(ee)
+
+    # Every template is read before the target is opened, so a bundle can
+    # be saved over the file it was loaded from
+    manifest = {"version": BUNDLE_VERSION, "events": "events.json", "templates": sorted(pngs)}
+    with zipfile.ZipFile(fname, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+        zf.writestr("events.json", json.dumps(export, indent=2, default=json_default))
+        for member, data in pngs.items():
+            # PNG is already compressed
+            zf.writestr(member, data, compress_type=zipfile.ZIP_STORED)
+
+def load_bundle(fname):
+    """Read a .mfz bundle; templates stay in the archive until first used"""
+    bundle = os.path.abspath(fname)
+    with zipfile.ZipFile(bundle) as zf:
+        manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
+        if manifest.get("version", 0) > BUNDLE_VERSION:
+            raise ValueError(f"{fname}: bundle version {manifest.get('version')} is newer than supported")
+        evts = json.loads(zf.read(manifest.get("events", "events.json")).decode("utf-8"))
+        members = set(zf.namelist())
+    for ev in evts:
+        tpl = ev.get("template")
+        if isinstance(tpl, dict) and tpl.get("png"):
+            if tpl["png"] not in members:
+                logging.warning(f"Bundle {fname}: missing template {tpl['png']}")
+            tpl["bundle"] = bundle
+    return evts
+
+def read_macro(fname, mmap=False):
+    """Load a macro file (JSON, .mfb, .mfz or a .mfj journal) and return its event list.
+
+    `mmap` maps .mfb sample columns instead of copying them; pass it only
+    when the events are never saved back (see load_mfb).
+    """
+    if is_mfb_path(fname):
+        return load_mfb(fname, mmap=mmap)
+    if is_journal_path(fname):
+        return read_journal(fname)
+    if is_bundle_path(fname):
+        return load_bundle(fname)
+    with open(fname, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    if not isinstance(data, list):
+        raise ValueError(f"{fname}: expected a list of events")
+    return data
+
+def atomic_write(fname, write):
+    """Call write(tmp_path), then move the result over `fname` in one step.
+
+    The temp file keeps `fname`'s extension, so format dispatch still works.
+    A crash or kill mid-save leaves the previous file intact.
+    """
+    root, ext = os.path.splitext(fname)
+    tmp = f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
+    try:
+        write(tmp)
+        with open(tmp, "rb+") as fh:
+            os.fsync(fh.fileno())
+        os.replace(tmp, fname)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def write_macro(fname, evts):
+    """Save events atomically as JSON, .mfb or .mfz (by extension).
+
+    Only .mfz bundles keep templates; the other formats drop them.
+    """
+    atomic_write(fname, lambda path: _write_macro_file(path, evts))
+
+def _write_macro_file(fname, evts):
+    if is_bundle_path(fname):
+        save_bundle(fname, evts)
+        return
+    export = []
+    for e in evts:
+        ee = dict(e)
+        ee.pop("template", None)
+        export.append(ee)
+    if is_mfb_path(fname):
+        save_mfb(fname, export)
+        return
+    with open(fname, "w", encoding="utf-8") as fh:
+        json.dump(export, fh, indent=2, default=json_default)
+
+class BackgroundWriter:
+    """Runs file saves on one worker thread so the Tk thread never blocks.
+
+    Jobs are `write(path)` callables, queued per target path: a newer job
+    for a path replaces one that has not started yet. `notify(text)` gets
+    progress lines (thread-safe callers only, e.g. the UI bus).
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # path -> (write, label, on_done)
+        self._busy = False
+        self._thread = None
+
+    def submit(self, fname, write, label=None, on_done=None):
+        """Queue `write(fname)`; `on_done(fname, error)` runs on the writer thread"""
+        with self._cond:
+            self._pending.pop(fname, None)
+            self._pending[fname] = (write, label or os.path.basename(fname), on_done)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="macro-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def save_events(self, fname, evts, label=None, on_done=None):
+        """Queue write_macro() of a snapshot of `evts`"""
+        snapshot = list(evts)
+        self.submit(fname, lambda path: write_macro(path, snapshot), label, on_done)
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending) + (1 if self._busy else 0)
+
+    def wait(self, timeout=None):
+        """Block until every queued save has finished; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _report(self, text):
+        logging.info(text)
+        if self.notify:
+            self.notify(text)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                fname, (write, label, on_done) = self._pending.popitem(last=False)
+                self._busy = True
+            self._report(f"Saving {label}...")
+            t = time.perf_counter()
+            error = None
+            try:
+                write(fname)
+                size = os.path.getsize(fname)
+                self._report(f"Saved {label} ({size / 1024:.0f} KiB, "
+                             f"{(time.perf_counter() - t) * 1000:.0f} ms)")
+            except Exception as e:
+                error = e
+                logging.exception(f"Background save of {fname} failed")
+                self._report(f"Save failed: {label}: {e}")
+            if on_done:
+                try:
+                    on_done(fname, error)
+                except Exception:
+                    logging.exception("BackgroundWriter on_done error")
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+# -----------------------
+# Recording journal
+# -----------------------
+JOURNAL_EXTENSION = ".mfj"
+
+def is_journal_path(fname):
+    return fname.lower().endswith(JOURNAL_EXTENSION)
+
+def new_journal_path(suffix=""):
+    """Fresh journal file name under JOURNAL_DIR"""
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(JOURNAL_DIR, f"recording_{stamp}{suffix}{JOURNAL_EXTENSION}")
+
+class RecordingJournal:
+    """Append-only on-disk log of a recording session (JSON lines, .mfj).
+
+    Listener threads only queue finished events; a journal thread encodes
+    them, one line per event with drag samples as a columnar chunk, and
+    fsyncs at most every `fsync_interval` seconds. A crash loses at most
+    that window, and read_journal() skips a torn last line.
+    """
+
+    def __init__(self, fname, algorithm="B", fsync_interval=JOURNAL_FSYNC_INTERVAL):
+        self.fname = fname
+        self.fsync_interval = fsync_interval
+        self.count = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._queue = queue.SimpleQueue()
+        self._fh = open(fname, "a", encoding="utf-8")
+        header = {"journal": "macroflow", "version": 1, "algorithm": algorithm, "started": time.time()}
+        self._fh.write(json.dumps(header) + "\n")
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def append(self, ev):
+        """Queue one finished event; False once the journal is closed"""
+        with self._lock:
+            if self._closed:
+                return False
+            self._queue.put(ev)
+            self.count += 1
+        return True
+
+    def close(self):
+        """Write everything queued, fsync and close; returns the file name"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._thread.join()
+        return self.fname
+
+    @staticmethod
+    def encode(ev):
+        samples = ev.get("samples")
+        if not isinstance(samples, SampleView):
+            return json.dumps({"e": ev}, default=json_default)
+        rest = {k: v for k, v in ev.items() if k != "samples"}
+        chunk = {"style": samples.style, "x": samples.xs.tolist(),
+                 "y": samples.ys.tolist(), "t": samples.ts.tolist()}
+        return json.dumps({"e": rest, "s": chunk}, default=json_default)
+
+    def _sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def _run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                ev = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                ev = False
+            if ev is None:
+                break
+            if ev is not False:
+                try:
+                    self._fh.write(self.encode(ev) + "\n")
+                    dirty = True
+                except Exception:
+                    logging.exception("Journal: could not write event")
+            if dirty and time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync()
+                dirty = False
+                last_sync = time.monotonic()
+        self._sync()
+        self._fh.close()
+
+def read_journal(fname):
+    """Events of a journal; a torn final line (crash mid-write) is dropped"""
+    evts = []
+    with open(fname, "r", encoding="utf-8") as fh:
+        for n, line in enumerate(fh, 1):
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                logging.warning(f"Journal {fname}: stopping at unreadable line {n}")
+                break
+            if "e" not in rec:
+                continue  # header
+            ev = rec["e"]
+            chunk = rec.get("s")
+            if chunk:
+                ev["samples"] = SampleView(array('i', chunk["x"]), array('i', chunk["y"]),
+                                           array('d', chunk["t"]), chunk["style"])
+            evts.append(ev)
+    return evts
+
+def compact_journal(journal_fname, out_fname=None, remove=True):
+    """Rewrite a journal as a normal macro file (.mfb by default).
+
+    The journal is removed once the macro is safely written.
+    """
+    out_fname = out_fname or os.path.splitext(journal_fname)[0] + MFB_EXTENSION
+    t = time.perf_counter()
+    evts = read_journal(journal_fname)
+    write_macro(out_fname, evts)
+    logging.info(f"Journal {journal_fname}: compacted {len(evts)} events to {out_fname} "
+                 f"in {(time.perf_counter() - t) * 1000:.0f} ms")
+    if remove:
+        os.remove(journal_fname)
+    return out_fname
 
 # -----------------------
 # Globals
 # -----------------------
-events = []  # recorded events
+events = EventList()  # recorded events
 recording = False
 playing = False
 last_event_time = None
@@ -146,7 +1102,7 @@ last_event_time = None
 _dragging = False
 _drag_start = None
 _drag_start_time = None
-_drag_samples = []
+_drag_samples = SampleBuffer()
 _drag_button = None  # Track which button is being dragged
 
 # template store
@@ -174,16 +1130,14 @@ HOTKEYS = {
 compact_mode = False
 compact_window = None
 
-# ensure template dir exists - UŻYJ POPRAWNEJ ŚCIEŻKI
-os.makedirs(TEMPLATE_DIR, exist_ok=True)
-
 # Dodaj informację o ścieżkach na konsolę dla debugowania
-print(f"=== MacroFlow Configuration ===")
-print(f"LOG_FILE: {LOG_FILE}")
-print(f"DATA_FILE: {DATA_FILE}")
-print(f"TEMPLATE_DIR: {TEMPLATE_DIR}")
-print(f"Is AppImage: {PATHS['is_appimage']}")
-print(f"===============================")
+def print_config_banner():
+    print(f"=== MacroFlow Configuration ===")
+    print(f"LOG_FILE: {LOG_FILE}")
+    print(f"DATA_FILE: {DATA_FILE}")
+    print(f"TEMPLATE_DIR: {TEMPLATE_DIR}")
+    print(f"Is AppImage: {PATHS['is_appimage']}")
+    print(f"===============================")
 
 # -----------------------
 # Helpers: screenshot conversions
@@ -206,6 +1160,16 @@ def screenshot_full_pil():
             return None
 
 def screenshot_region_pil(left, top, w, h):
+    if capture_backend().name != "pil":
+        # array backends: crop the shared frame instead of grabbing again
+        region, x0, y0 = FRAME_PROVIDER.region(left, top, w, h)
+        if region is not None:
+            # keep the requested size at screen edges; off-screen pixels are
+            # black, as with ImageGrab
+            out = np.zeros((h, w, 3), dtype=np.uint8)
+            rh, rw = region.shape[:2]
+            out[y0 - top:y0 - top + rh, x0 - left:x0 - left + rw] = region[:, :, ::-1]
+            return Image.fromarray(out)
     try:
         return ImageGrab.grab(bbox=(left, top, left + w, top + h))
     except Exception as e:
@@ -215,17 +1179,550 @@ def screenshot_region_pil(left, top, w, h):
         except Exception:
             return None
 
+def grab_pixel(x, y):
+    """RGB tuple at (x, y), or None when off-screen, without forcing a full grab.
+
+    Uses the shared frame when one is cached or pinned (or the backend grabs
+    cheaply); otherwise grabs just the 1x1 region. Keeps recording-time
+    lookups in the pynput callbacks fast on large screens.
+    """
+    if capture_backend().name != "pil":
+        return FRAME_PROVIDER.pixel(x, y)
+    color = FRAME_PROVIDER.peek_pixel(x, y)
+    if color is None:
+        img = ImageGrab.grab(bbox=(int(x), int(y), int(x) + 1, int(y) + 1))
+        color = tuple(img.getpixel((0, 0))[:3])
+    return color
+
 def get_pixel_color(x, y):
     """Return RGB tuple at screen pixel (x,y)."""
     try:
-        im = screenshot_region_pil(x, y, 1, 1)
-        if im is None:
-            return (0,0,0)
-        return im.getpixel((0,0))
+        color = grab_pixel(x, y)
+        return color if color is not None else (0,0,0)
     except Exception as e:
         logging.exception("get_pixel_color error")
         return (0,0,0)
 
+# -----------------------
+# Screen capture backends
+# -----------------------
+class PILCapture:
+    """Default capture: PIL.ImageGrab (pyautogui fallback), a new image per grab"""
+    name = "pil"
+
+    def grab(self):
+        """Full screen as a PIL image, or None"""
+        return screenshot_full_pil()
+
+    def close(self):
+        pass
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int),
+                ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+class _XImage(ctypes.Structure):
+    # leading fields of Xlib's XImage; the function table is not needed
+    _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int),
+                ("xoffset", ctypes.c_int), ("format", ctypes.c_int),
+                ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+                ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int),
+                ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int),
+                ("red_mask", ctypes.c_ulong), ("green_mask", ctypes.c_ulong),
+                ("blue_mask", ctypes.c_ulong)]
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_int), ("display", ctypes.c_void_p),
+                ("resourceid", ctypes.c_ulong), ("serial", ctypes.c_ulong),
+                ("error_code", ctypes.c_ubyte), ("request_code", ctypes.c_ubyte),
+                ("minor_code", ctypes.c_ubyte)]
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+_X_ERROR_NAMES = {2: "BadValue", 8: "BadMatch", 9: "BadDrawable", 10: "BadAccess", 11: "BadAlloc"}
+# XSetErrorHandler is process-wide; one trap at a time
+_X_ERROR_LOCK = threading.Lock()
+
+class XShmCapture:
+    """X11 capture through the MIT-SHM extension into one reused buffer.
+
+    grab() returns an HxWx4 BGRA NumPy view of the shared segment, so a
+    frame costs one XShmGetImage with no allocation and no PIL round trip.
+    The view is overwritten by the next grab(). Needs libX11/libXext and a
+    32 bpp little-endian TrueColor screen. X errors on attach and grab raise
+    RuntimeError instead of reaching Xlib's default handler, which exits the
+    process; a grab that fails (e.g. after a resolution change) reopens the
+    segment at the new size once.
+    """
+    name = "xshm"
+
+    def __init__(self, display_name=None):
+        import ctypes.util
+        c = ctypes
+        x11 = c.CDLL(ctypes.util.find_library("X11") or "libX11.so.6")
+        xext = c.CDLL(ctypes.util.find_library("Xext") or "libXext.so.6")
+        libc = c.CDLL(None, use_errno=True)
+        x11.XOpenDisplay.restype = c.c_void_p
+        x11.XOpenDisplay.argtypes = [c.c_char_p]
+        for fn in (x11.XDefaultScreen, x11.XCloseDisplay, xext.XShmQueryExtension):
+            fn.argtypes = [c.c_void_p]
+        for fn in (x11.XRootWindow, x11.XDefaultVisual, x11.XDefaultDepth,
+                   x11.XDisplayWidth, x11.XDisplayHeight, x11.XSync):
+            fn.argtypes = [c.c_void_p, c.c_int]
+        x11.XRootWindow.restype = c.c_ulong
+        x11.XDefaultVisual.restype = c.c_void_p
+        x11.XFree.argtypes = [c.c_void_p]
+        x11.XSetErrorHandler.restype = c.c_void_p
+        x11.XSetErrorHandler.argtypes = [_XErrorHandler]
+        xext.XShmCreateImage.restype = c.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [c.c_void_p, c.c_void_p, c.c_uint, c.c_int, c.c_void_p,
+                                         c.POINTER(_XShmSegmentInfo), c.c_uint, c.c_uint]
+        xext.XShmAttach.argtypes = [c.c_void_p, c.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [c.c_void_p, c.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [c.c_void_p, c.c_ulong, c.POINTER(_XImage),
+                                      c.c_int, c.c_int, c.c_ulong]
+        libc.shmget.restype = c.c_int
+        libc.shmget.argtypes = [c.c_int, c.c_size_t, c.c_int]
+        libc.shmat.restype = c.c_void_p
+        libc.shmat.argtypes = [c.c_int, c.c_void_p, c.c_int]
+        libc.shmdt.argtypes = [c.c_void_p]
+        libc.shmctl.argtypes = [c.c_int, c.c_int, c.c_void_p]
+        self._x11, self._xext, self._libc = x11, xext, libc
+        self._dpy = self._image = self._addr = None
+        self._attached = False
+        self._display_name = display_name
+        self._seg = _XShmSegmentInfo()
+        try:
+            self._open(display_name)
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self, display_name):
+        x11, xext, libc, seg = self._x11, self._xext, self._libc, self._seg
+        self._dpy = x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self._dpy:
+            raise RuntimeError("cannot open the X display")
+        if not xext.XShmQueryExtension(self._dpy):
+            raise RuntimeError("the X server has no MIT-SHM extension")
+        screen = x11.XDefaultScreen(self._dpy)
+        self._root = x11.XRootWindow(self._dpy, screen)
+        width, height = x11.XDisplayWidth(self._dpy, screen), x11.XDisplayHeight(self._dpy, screen)
+        self._image = xext.XShmCreateImage(self._dpy, x11.XDefaultVisual(self._dpy, screen),
+                                           x11.XDefaultDepth(self._dpy, screen), 2,  # ZPixmap
+                                           None, ctypes.byref(seg), width, height)
+        if not self._image:
+            raise RuntimeError("XShmCreateImage failed")
+        im = self._image.contents
+        if im.bits_per_pixel != 32 or im.byte_order != 0 or im.red_mask != 0xFF0000:
+            raise RuntimeError(f"unsupported pixel layout ({im.bits_per_pixel} bpp)")
+        size = im.bytes_per_line * im.height
+        seg.shmid = libc.shmget(0, size, 0o1600)  # IPC_PRIVATE, IPC_CREAT | 0600
+        if seg.shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        addr = libc.shmat(seg.shmid, None, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            libc.shmctl(seg.shmid, 0, None)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        self._addr = seg.shmaddr = im.data = addr
+        seg.readOnly = 0
+        # BadAccess here for a remote display or a server running as another user
+        self._trap_x_errors("XShmAttach", lambda: xext.XShmAttach(self._dpy, ctypes.byref(seg)))
+        self._attached = True
+        # IPC_RMID now: the segment goes away once both sides detach or exit
+        libc.shmctl(seg.shmid, 0, None)
+        buf = (ctypes.c_ubyte * size).from_address(addr)
+        rows = np.frombuffer(buf, dtype=np.uint8).reshape(im.height, im.bytes_per_line // 4, 4)
+        self._view = rows[:, :im.width]
+        self.size = (im.width, im.height)
+
+    def _trap_x_errors(self, what, request):
+        """Run `request()` and XSync; an X error on our display raises RuntimeError"""
+        errors = []
+        chain = []
+
+        def handler(dpy, event):
+            if dpy == self._dpy:
+                errors.append(event.contents.error_code)
+                return 0
+            return chain[0](dpy, event) if chain else 0
+
+        trap = _XErrorHandler(handler)
+        with _X_ERROR_LOCK:
+            previous = self._x11.XSetErrorHandler(trap)
+            if previous:
+                chain.append(_XErrorHandler(previous))
+            try:
+                ok = request()
+                self._x11.XSync(self._dpy, 0)
+            finally:
+                self._x11.XSetErrorHandler(chain[0] if chain else _XErrorHandler())
+        if errors:
+            code = errors[0]
+            raise RuntimeError(f"{what} failed: X error {_X_ERROR_NAMES.get(code, code)}")
+        if not ok:
+            raise RuntimeError(f"{what} failed")
+
+    def _get_image(self):
+        if not self._dpy:
+            raise RuntimeError("XShm capture is closed")
+        self._trap_x_errors("XShmGetImage", lambda: self._xext.XShmGetImage(
+            self._dpy, self._root, self._image, 0, 0, ctypes.c_ulong(-1).value))
+
+    def grab(self):
+        """Full screen as an HxWx4 BGRA view of the shared buffer"""
+        try:
+            self._get_image()
+        except RuntimeError as e:
+            # BadMatch once the screen no longer matches the segment: start over
+            logging.warning(f"XShm capture: {e}; reopening")
+            self.close()
+            self._open(self._display_name)
+            self._get_image()
+        return self._view
+
+    def close(self):
+        self._view = None
+        if self._attached:
+            self._attached = False
+            try:
+                self._trap_x_errors("XShmDetach",
+                                    lambda: self._xext.XShmDetach(self._dpy, ctypes.byref(self._seg)))
+            except RuntimeError as e:
+                logging.warning(f"XShm capture: {e}")
+        if self._addr:
+            self._libc.shmdt(self._addr)
+            self._addr = None
+        if self._image:
+            self._x11.XFree(self._image)
+            self._image = None
+        if self._dpy:
+            self._x11.XCloseDisplay(self._dpy)
+            self._dpy = None
+
+class XwdCapture:
+    """Zero-copy capture from an Xvfb framebuffer file (Xvfb -fbdir DIR).
+
+    Xvfb keeps its screen in an XWD file that it updates in place. The file
+    is memory-mapped once, so a grab is one memcpy of the pixels into a
+    reused HxWx4 BGRA buffer with no X round trip. Copying keeps the frame
+    fixed while FRAME_PROVIDER is pinned; the mapping itself changes as the
+    server draws. The buffer is overwritten by the next grab(). Needs a
+    32 bpp screen (depth 24).
+    """
+    name = "xwd"
+
+    def __init__(self, path=None):
+        path = path or XWD_FRAMEBUFFER
+        if not path:
+            raise RuntimeError("no Xvfb framebuffer file set (XWD_FRAMEBUFFER)")
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        head = mm[:100].tobytes()
+        # Xvfb writes the header big-endian; accept either order
+        for order in (">", "<"):
+            fields = struct.unpack(order + "25I", head)
+            if fields[1] == 7:  # XWD_FILE_VERSION
+                break
+        else:
+            raise ValueError(f"{path}: not an XWD file")
+        header_size, width, height = fields[0], fields[4], fields[5]
+        pixmap_format, byte_order, bpp, bpl = fields[2], fields[7], fields[11], fields[12]
+        if pixmap_format != 2 or bpp != 32 or byte_order != 0 or fields[14] != 0xFF0000:
+            raise ValueError(f"{path}: unsupported pixel layout ({bpp} bpp)")
+        offset = header_size + fields[19] * 12  # header, window name, colormap
+        rows = mm[offset:offset + bpl * height].reshape(height, bpl // 4, 4)
+        self._mm = mm
+        self._view = rows[:, :width]
+        self._frame = np.empty((height, width, 4), dtype=np.uint8)
+        self.path = path
+        self.size = (width, height)
+
+    def grab(self):
+        """Full screen as an HxWx4 BGRA snapshot of the framebuffer file"""
+        np.copyto(self._frame, self._view)
+        return self._frame
+
+    def close(self):
+        self._view = None
+        self._frame = None
+        self._mm = None
+
+CAPTURE_BACKENDS = {"pil": PILCapture, "xshm": XShmCapture, "xwd": XwdCapture}
+_capture_backend = None
+
+def capture_backend():
+    """The active capture backend, created from CAPTURE_BACKEND on first use"""
+    if _capture_backend is None:
+        set_capture_backend(CAPTURE_BACKEND)
+    return _capture_backend
+
+def set_capture_backend(name, fallback=True):
+    """Grab frames through backend `name`.
+
+    If it cannot start, falls back to PIL, or re-raises with `fallback` False.
+    """
+    global _capture_backend
+    try:
+        backend = CAPTURE_BACKENDS[name]()
+    except Exception as e:
+        if not fallback:
+            raise
+        logging.warning(f"Capture backend {name!r} unavailable ({e}); using PIL")
+        backend = PILCapture()
+    with FRAME_PROVIDER._lock:
+        old, _capture_backend = _capture_backend, backend
+        FRAME_PROVIDER.invalidate()
+        if old is not None:
+            old.close()
+    logging.info(f"Capture backend: {backend.name}")
+    return backend
+
+# -----------------------
+# Shared screen frame
+# -----------------------
+class FrameProvider:
+    """Share one full-screen grab between all locators for a short time.
+
+    Every pixel/colour/template lookup crops from the cached frame instead of
+    doing its own grab. Frames come from the capture backend as a PIL image
+    or, with XShmCapture, a BGRA array that is converted straight to what a
+    lookup needs. The frame is re-grabbed after `ttl` seconds and dropped
+    whenever input is injected. While pinned (see `pinned()`) the frame does
+    not expire, so one locate sequence works on a single snapshot.
+    """
+
+    def __init__(self, ttl=FRAME_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._pins = 0
+        self._raw = None  # as grabbed: PIL image or HxWx4 BGRA array
+        self._rgb = None
+        self._bgr = None
+        self._gray = None
+        self._levels = {}  # (level, gray) -> downscaled frame
+        self._stamp = 0.0
+        self.grabs = 0
+        self.hits = 0
+
+    def invalidate(self):
+        """Drop the cached frame (called after every injected input)"""
+        with self._lock:
+            self._raw = None
+            self._rgb = None
+            self._bgr = None
+            self._gray = None
+            self._levels = {}
+
+    @contextmanager
+    def pinned(self):
+        """Keep the current frame alive for a whole locate sequence"""
+        with self._lock:
+            self._pins += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._pins -= 1
+
+    def _current(self):
+        # Caller holds the lock
+        now = time.perf_counter()
+        stale = self._pins == 0 and now - self._stamp > self.ttl
+        if self._raw is None or stale:
+            self._raw = capture_backend().grab()
+            self._rgb = None
+            self._bgr = None
+            self._gray = None
+            self._levels = {}
+            self._stamp = now
+            self.grabs += 1
+        else:
+            self.hits += 1
+        return self._raw
+
+    def frame(self):
+        """Full-screen PIL image"""
+        with self._lock:
+            raw = self._current()
+            if isinstance(raw, np.ndarray):
+                return Image.fromarray(self.rgb())
+            return raw
+
+    def rgb(self):
+        """Full frame as HxWx3 uint8 RGB array"""
+        with self._lock:
+            raw = self._current()
+            if raw is None:
+                return None
+            if self._rgb is None:
+                if isinstance(raw, np.ndarray):
+                    self._rgb = cv2.cvtColor(raw, cv2.COLOR_BGRA2RGB)
+                else:
+                    self._rgb = np.asarray(raw if raw.mode == "RGB" else raw.convert("RGB"))
+            return self._rgb
+
+    def bgr(self):
+        """Full frame as HxWx3 uint8 BGR array (OpenCV order)"""
+        with self._lock:
+            raw = self._current()
+            if raw is None:
+                return None
+            if self._bgr is None:
+                if isinstance(raw, np.ndarray):
+                    self._bgr = cv2.cvtColor(raw, cv2.COLOR_BGRA2BGR)
+                else:
+                    self._bgr = cv2.cvtColor(self.rgb(), cv2.COLOR_RGB2BGR)
+            return self._bgr
+
+    def gray(self):
+        """Full frame as HxW uint8 grayscale array"""
+        with self._lock:
+            raw = self._current()
+            if raw is None:
+                return None
+            if self._gray is None:
+                if isinstance(raw, np.ndarray):
+                    self._gray = cv2.cvtColor(raw, cv2.COLOR_BGRA2GRAY)
+                else:
+                    self._gray = cv2.cvtColor(self.rgb(), cv2.COLOR_RGB2GRAY)
+            return self._gray
+
+    def image(self, level=0, gray=False):
+        """BGR (or gray) frame downscaled `level` times by 2 (cached per frame)"""
+        with self._lock:
+            if level <= 0:
+                return self.gray() if gray else self.bgr()
+            scaled = self._levels.get((level, gray))
+            if scaled is None:
+                prev = self.image(level - 1, gray)
+                if prev is None:
+                    return None
+                scaled = cv2.pyrDown(prev)
+                self._levels[(level, gray)] = scaled
+            return scaled
+
+    def region(self, left, top, w, h, level=0, gray=False):
+        """View of a frame region clipped to the screen.
+
+        Returns (array, left, top) where left/top are the clipped origin in
+        screen coordinates. With `level` > 0 the view is taken from the
+        downscaled frame (see `image`). With a BGRA capture backend and no
+        converted full frame cached, only the region itself is converted.
+        """
+        with self._lock:
+            frame, code = None, None
+            if level == 0 and (self._gray if gray else self._bgr) is None:
+                raw = self._current()
+                if isinstance(raw, np.ndarray):
+                    frame = raw
+                    code = cv2.COLOR_BGRA2GRAY if gray else cv2.COLOR_BGRA2BGR
+            if frame is None:
+                frame = self.image(level, gray)
+            if frame is None:
+                return None, left, top
+            fh, fw = frame.shape[:2]
+            x0, y0 = max(0, left >> level), max(0, top >> level)
+            x1, y1 = min(fw, (left + w) >> level), min(fh, (top + h) >> level)
+            if x1 <= x0 or y1 <= y0:
+                return None, x0 << level, y0 << level
+            view = frame[y0:y1, x0:x1]
+            if code is not None:
+                view = cv2.cvtColor(view, code)
+            return view, x0 << level, y0 << level
+
+    def pixel(self, x, y):
+        """RGB tuple at (x, y), or None when off-screen"""
+        with self._lock:
+            raw = self._current()
+            if isinstance(raw, np.ndarray):
+                frame, order = raw, (2, 1, 0)  # read BGRA in place
+            else:
+                frame, order = self.rgb(), (0, 1, 2)
+            if frame is None:
+                return None
+            x, y = int(x), int(y)
+            if 0 <= y < frame.shape[0] and 0 <= x < frame.shape[1]:
+                px = frame[y, x]
+                return tuple(int(px[i]) for i in order)
+            return None
+
+    def peek_pixel(self, x, y):
+        """Like pixel(), but only from a frame that is already cached and not
+        expired; returns None instead of grabbing"""
+        with self._lock:
+            expired = self._pins == 0 and time.perf_counter() - self._stamp > self.ttl
+            if self._raw is None or expired:
+                return None
+            return self.pixel(x, y)
+
+FRAME_PROVIDER = FrameProvider(FRAME_TTL)
+
+@lru_cache(maxsize=32)
+def _color_search_order(max_rad, step):
+    """Offsets of a (2*max_rad)^2 window sorted by distance from its centre.
+
+    Returns (dx, dy, d2, reach) arrays: squared distance and the smallest
+    radius whose search window [-rad, rad) still contains the offset.
+    """
+    first = -(max_rad // step) * step
+    offs = np.arange(first, max_rad, step, dtype=np.int32)
+    dy, dx = np.meshgrid(offs, offs, indexing="ij")
+    dx = dx.ravel()
+    dy = dy.ravel()
+    d2 = dx * dx + dy * dy
+    order = np.argsort(d2, kind="stable")
+    dx, dy, d2 = dx[order], dy[order], d2[order]
+    reach = np.maximum(np.maximum(-dx, dx + 1), np.maximum(-dy, dy + 1))
+    return dx, dy, d2, reach
+
+def find_color_in_rings(x, y, color, rings, step=1):
+    """Find the pixel nearest to (x, y) whose colour matches `color`.
+
+    `rings` is a sequence of (radius, tolerance) pairs tried in order; the
+    first ring with a hit wins. The largest window is cut from the shared
+    frame once; candidates are compared vectorized, nearest first, so a
+    target that hasn't moved only costs the innermost ring.
+    """
+    frame = FRAME_PROVIDER.rgb()
+    if frame is None or not rings:
+        return None
+    x, y = int(x), int(y)
+    max_rad = max(rad for rad, _ in rings)
+    dx, dy, d2, reach = _color_search_order(max_rad, step)
+
+    fh, fw = frame.shape[:2]
+    x0, y0 = max(0, x - max_rad), max(0, y - max_rad)
+    x1, y1 = min(fw, x + max_rad), min(fh, y + max_rad)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    window = frame[y0:y1, x0:x1]
+    wh, ww = window.shape[:2]
+    px = x + dx - x0
+    py = y + dy - y0
+    tr, tg, tb = (int(c) for c in color[:3])
+
+    # Max channel distance per candidate, filled lazily in distance order;
+    # off-screen candidates keep 256 and never match
+    dist = np.full(dx.shape, 256, dtype=np.int16)
+    done = 0
+    for rad, tol in rings:
+        # Only the prefix of offsets that can still lie inside this ring
+        n = int(np.searchsorted(d2, 2 * rad * rad, side="right"))
+        if n > done:
+            cx, cy = px[done:n], py[done:n]
+            ok = (cx >= 0) & (cx < ww) & (cy >= 0) & (cy < wh)
+            pix = window[cy[ok], cx[ok]].astype(np.int16)
+            part = np.abs(pix[:, 0] - tr)
+            np.maximum(part, np.abs(pix[:, 1] - tg), out=part)
+            np.maximum(part, np.abs(pix[:, 2] - tb), out=part)
+            dist[done:n][ok] = part
+            done = n
+        hits = np.flatnonzero((dist[:n] <= tol) & (reach[:n] <= rad))
+        if hits.size:
+            i = hits[0]
+            return (x + int(dx[i]), y + int(dy[i]))
+    return None
+
 # -----------------------
 # Template utilities
 # -----------------------
@@ -254,6 +1751,121 @@ def load_template_from_file(path):
         logging.exception("load_template_from_file error")
         return None
 
+def load_template_from_bundle(bundle, member):
+    """Decode a PNG template stored in a .mfz bundle to BGR"""
+    try:
+        with zipfile.ZipFile(bundle) as zf:
+            data = zf.read(member)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception:
+        logging.exception(f"load_template_from_bundle error: {member}")
+        return None
+
+def inline_template_digest(source):
+    """Content hash of an inline "bgr" template (nested list or array)"""
+    arr = np.ascontiguousarray(np.asarray(source, dtype=np.uint8))
+    return hashlib.sha1(repr(arr.shape).encode() + arr.tobytes()).hexdigest()
+
+class TemplateCache:
+    """Process-wide LRU cache of decoded, ready-to-match templates.
+
+    File templates are keyed by absolute path and revalidated against the
+    file's mtime/size; inline "bgr" lists are keyed by a hash of their
+    pixels (no reference to the list is kept, so `max_bytes` bounds the
+    memory held); bundled PNGs are keyed by their content-addressed name.
+    Entries are contiguous uint8 arrays, evicted least-recently-used once
+    the total exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (array, stamp)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tpl_info, color=False, digest=None):
+        """Return the template as a contiguous uint8 array, or None.
+
+        The array is single-channel when GRAYSCALE_MATCHING is on, unless
+        `color` or the inline template's "match_color" asks for BGR.
+        `digest` (inline_template_digest) spares hashing an inline template
+        the caller has already hashed.
+        """
+        color = (color or not GRAYSCALE_MATCHING
+                 or (isinstance(tpl_info, dict) and bool(tpl_info.get("match_color"))))
+        if isinstance(tpl_info, str):
+            try:
+                st = os.stat(tpl_info)
+            except OSError:
+                return None
+            key = ("file", os.path.abspath(tpl_info), color)
+            stamp = (st.st_mtime_ns, st.st_size)
+        elif isinstance(tpl_info, dict) and tpl_info.get("png") and tpl_info.get("bundle"):
+            key = ("bundle", tpl_info["png"], color)
+            stamp = tpl_info["png"]
+        elif isinstance(tpl_info, dict) and tpl_info.get("bgr") is not None:
+            try:
+                digest = digest or inline_template_digest(tpl_info["bgr"])
+            except Exception:
+                logging.exception("TemplateCache: invalid inline template")
+                return None
+            key = ("inline", digest, color)
+            stamp = digest
+        else:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached, cached_stamp = entry
+                if cached_stamp == stamp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached
+            self.misses += 1
+
+        if key[0] == "file":
+            arr = load_template_from_file(tpl_info)
+        elif key[0] == "bundle":
+            arr = load_template_from_bundle(tpl_info["bundle"], tpl_info["png"])
+        else:
+            arr = np.array(tpl_info["bgr"], dtype=np.uint8)
+        if arr is None:
+            return None
+        if not color and arr.ndim == 3:
+            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2GRAY)
+        arr = np.ascontiguousarray(arr)
+        self._store(key, arr, stamp)
+        return arr
+
+    def _store(self, key, arr, stamp):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0].nbytes
+            if arr.nbytes > self.max_bytes:
+                return
+            self._entries[key] = (arr, stamp)
+            self._bytes += arr.nbytes
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        """One-line summary for the log"""
+        with self._lock:
+            total = self.hits + self.misses
+            rate = (100.0 * self.hits / total) if total else 0.0
+            return (f"{len(self._entries)} templates, {self._bytes / 1024:.0f} KiB, "
+                    f"hits={self.hits} misses={self.misses} ({rate:.1f}% hit) "
+                    f"evictions={self.evictions}")
+
+TEMPLATE_CACHE = TemplateCache(TEMPLATE_CACHE_MAX_BYTES)
+
 def register_template(name, path, bgr):
     templates.append({"name": name, "path": path, "bgr": bgr})
 
@@ -262,30 +1874,36 @@ def register_template(name, path, bgr):
 # -----------------------
 def match_template_search(template_bgr, bbox=None, threshold=TEMPLATE_MATCH_THRESH):
     """
-    Search template on screen.
+    Search template on the shared screen frame.
     Return center_x, center_y, score or (None,None,0).
     """
     try:
+        # frame layout follows the template: 2-D -> grayscale, 3-D -> BGR
+        gray = template_bgr.ndim == 2
         if bbox is None:
-            pil = screenshot_full_pil()
-            if pil is None:
-                return None, None, 0.0
-            search_img = pil_to_cv2(pil)
+            search_img = FRAME_PROVIDER.image(gray=gray)
             offx, offy = 0, 0
         else:
             left, top, w, h = bbox
-            pil = screenshot_region_pil(left, top, w, h)
-            if pil is None:
-                return None, None, 0.0
-            search_img = pil_to_cv2(pil)
-            offx, offy = left, top
+            search_img, offx, offy = FRAME_PROVIDER.region(left, top, w, h, gray=gray)
+        if search_img is None:
+            return None, None, 0.0
+        th, tw = template_bgr.shape[0], template_bgr.shape[1]
+        if search_img.shape[0] < th or search_img.shape[1] < tw:
+            return None, None, 0.0
+
+        if PYRAMID_MATCHING:
+            levels = pyramid_levels(th, tw)
+            big = search_img.shape[0] * search_img.shape[1] >= PYRAMID_MIN_SEARCH_RATIO * th * tw
+            if levels and big:
+                h, w = search_img.shape[:2]
+                return _match_pyramid(template_bgr, (offx, offy, w, h), threshold, levels)
 
         res = cv2.matchTemplate(search_img, template_bgr, cv2.TM_CCOEFF_NORMED)
         if res is None:
             return None, None, 0.0
         min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
         if max_val >= threshold:
-            th, tw = template_bgr.shape[0], template_bgr.shape[1]
             center_x = offx + max_loc[0] + tw // 2
             center_y = offy + max_loc[1] + th // 2
             return center_x, center_y, float(max_val)
@@ -294,6 +1912,88 @@ def match_template_search(template_bgr, bbox=None, threshold=TEMPLATE_MATCH_THRE
         logging.exception("match_template_search error")
         return None, None, 0.0
 
+def pyramid_levels(th, tw):
+    """How many times a th x tw template can be halved for coarse matching"""
+    levels = 0
+    while levels < PYRAMID_MAX_LEVELS and min(th, tw) >> (levels + 1) >= PYRAMID_MIN_TEMPLATE:
+        levels += 1
+    return levels
+
+def _match_pyramid(template_bgr, bbox, threshold, levels):
+    """Coarse match on the downscaled frame, refine peaks at full resolution"""
+    left, top, w, h = bbox
+    th, tw = template_bgr.shape[:2]
+    gray = template_bgr.ndim == 2
+    small_tpl = template_bgr
+    for _ in range(levels):
+        small_tpl = cv2.pyrDown(small_tpl)
+    coarse, cx0, cy0 = FRAME_PROVIDER.region(left, top, w, h, level=levels, gray=gray)
+    if coarse is None or coarse.shape[0] < small_tpl.shape[0] or coarse.shape[1] < small_tpl.shape[1]:
+        return None, None, 0.0
+    res = cv2.matchTemplate(coarse, small_tpl, cv2.TM_CCOEFF_NORMED)
+    scale = 1 << levels
+    pad = 2 * scale
+    sth, stw = small_tpl.shape[:2]
+    best = 0.0
+    for _ in range(PYRAMID_CANDIDATES):
+        _, coarse_val, _, loc = cv2.minMaxLoc(res)
+        if coarse_val < threshold - PYRAMID_COARSE_SLACK:
+            break
+        # refine in a window around the coarse hit
+        rx = cx0 + loc[0] * scale - pad
+        ry = cy0 + loc[1] * scale - pad
+        win, offx, offy = FRAME_PROVIDER.region(rx, ry, tw + 2 * pad, th + 2 * pad, gray=gray)
+        if win is not None and win.shape[0] >= th and win.shape[1] >= tw:
+            fine = cv2.matchTemplate(win, template_bgr, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(fine)
+            best = max(best, float(max_val))
+            if max_val >= threshold:
+                return offx + max_loc[0] + tw // 2, offy + max_loc[1] + th // 2, float(max_val)
+        # suppress this peak and try the next one
+        res[max(0, loc[1] - sth // 2):loc[1] + sth // 2 + 1,
+            max(0, loc[0] - stw // 2):loc[0] + stw // 2 + 1] = -1.0
+    return None, None, best
+
+def search_radii(template_bgr, radii=None):
+    """Radii for a locality-first search around the recorded position.
+
+    `radii` (e.g. an event's "search_radii") overrides the default, which
+    starts at the template size and grows by SEARCH_GROWTH up to
+    SEARCH_MAX_RADIUS.
+    """
+    if radii:
+        return [int(r) for r in radii]
+    th, tw = template_bgr.shape[:2]
+    r = max(SEARCH_BASE_RADIUS, th, tw)
+    out = []
+    while r < SEARCH_MAX_RADIUS:
+        out.append(int(r))
+        r *= SEARCH_GROWTH
+    return out
+
+def locate_template(template_bgr, pos, radii=None, threshold=TEMPLATE_MATCH_THRESH, cancel=None):
+    """Find a template nearest-first: recorded neighbourhood, wider rings, full screen.
+
+    Return (center_x, center_y, score, radius); radius is None for a
+    full-screen hit and center is (None, None) when nothing matched.
+    With a `cancel` token, raises PlaybackCancelled between searches.
+    """
+    best = 0.0
+    with FRAME_PROVIDER.pinned():
+        if pos:
+            for r in search_radii(template_bgr, radii):
+                if cancel is not None:
+                    cancel.check()
+                bbox = (pos[0]-r, pos[1]-r, r*2, r*2)
+                cx, cy, sc = match_template_search(template_bgr, bbox=bbox, threshold=threshold)
+                if cx is not None:
+                    return cx, cy, sc, r
+                best = max(best, sc)
+        if cancel is not None:
+            cancel.check()
+        cx, cy, sc = match_template_search(template_bgr, bbox=None, threshold=threshold)
+        return cx, cy, max(best, sc), None
+
 # -----------------------
 # Recording handlers (pynput) - ORIGINAL VERSION with RIGHT CLICK SUPPORT
 # -----------------------
@@ -301,9 +2001,9 @@ def _on_move(x, y):
     global _dragging, _drag_samples
     try:
         if recording and _dragging:
-            _drag_samples.append({"x": int(x), "y": int(y), "t": time.perf_counter()})
+            _drag_samples.append(x, y, time.perf_counter())
     except Exception:
-        logging.exception("_on_move error (ignored)")
+        SAMPLE_LOG.exception("_on_move error (ignored)")
 
 def _on_click(x, y, button, pressed):
     global recording, events, last_event_time
@@ -318,14 +2018,15 @@ def _on_click(x, y, button, pressed):
             _dragging = True
             _drag_start = (int(x), int(y))
             _drag_start_time = now
-            _drag_samples = [{"x": int(x), "y": int(y), "t": time.perf_counter()}]
+            _drag_samples.clear()
+            _drag_samples.append(x, y, time.perf_counter())
             _drag_button = button  # Store which button is being used
             logging.info(f"Record {button} press at {_drag_start}")
             return
 
         # release
         if _dragging and button == _drag_button:  # Only process if it's the same button
-            _drag_samples.append({"x": int(x), "y": int(y), "t": time.perf_counter()})
+            _drag_samples.append(x, y, time.perf_counter())
             duration = max(0.0, now - (_drag_start_time or now))
             # compute delay since last event
             if last_event_time is None:
@@ -353,12 +2054,7 @@ def _on_click(x, y, button, pressed):
                 logging.info(f"Recorded {button_name.upper()} CLICK at {(x,y)}")
             else:
                 # normalize dt deltas
-                normalized = []
-                prev_t = _drag_samples[0]["t"]
-                for s in _drag_samples:
-                    dt = s["t"] - prev_t
-                    normalized.append({"x": int(s["x"]), "y": int(s["y"]), "dt": float(dt)})
-                    prev_t = s["t"]
+                normalized = _drag_samples.view("b")
                 ev = {
                     "type": "drag",
                     "start": (_drag_start[0], _drag_start[1]),
@@ -370,7 +2066,7 @@ def _on_click(x, y, button, pressed):
                     "samples": normalized,
                     "template": None
                 }
-                logging.info(f"Recorded {button_name.upper()} DRAG {ev['start']} -> {ev['end']} samples={len(normalized)} dur={duration:.3f}s")
+                logging.info(f"Recorded {button_name.upper()} DRAG {ev['start']} -> {ev['end']} samples={len(normalized)} ({normalized.nbytes()} B) dur={duration:.3f}s")
 
             events.append(ev)
             last_event_time = now
@@ -379,7 +2075,7 @@ def _on_click(x, y, button, pressed):
             _dragging = False
             _drag_start = None
             _drag_start_time = None
-            _drag_samples = []
+            _drag_samples.clear()
             _drag_button = None
     except Exception:
         logging.exception("_on_click error")
@@ -466,288 +2162,1052 @@ def _on_key_release_record(key):
 # Playback functions
 # -----------------------
 def play_click_event(ev, gui_log=None):
-    pos = ev.get("pos")
-    button = ev.get("button", "left")
+    run_op(compile_event(ev), gui_log)
+
+def play_drag_event(ev, gui_log=None):
+    run_op(compile_event(ev), gui_log)
+
+def play_key_event(ev, gui_log=None):
+    """Play keyboard key press/release event"""
+    run_op(compile_event(ev), gui_log)
+
+def find_color_near_simple(x, y, color, radius=10):
+    """Vectorized color search around (x, y)"""
+    rings = [(radius, 4), (radius*2, 4), (radius*3, 4)]
+    try:
+        return find_color_in_rings(x, y, color, rings)
+    except Exception:
+        logging.exception("find_color_near_simple error")
+        return None
+
+# -----------------------
+# Compiled playback plan
+# -----------------------
+# Recorded key names -> pyautogui key names (anything else is lower-cased)
+KEY_MAPPING = {
+    'space': 'space',
+    'enter': 'enter',
+    'tab': 'tab',
+    'backspace': 'backspace',
+    'esc': 'esc',
+    'shift': 'shift',
+    'ctrl': 'ctrl',
+    'alt': 'alt',
+    'cmd': 'win' if sys.platform == 'win32' else 'command',
+    'win': 'win',
+    'up': 'up',
+    'down': 'down',
+    'left': 'left',
+    'right': 'right',
+    'page_up': 'pageup',
+    'page_down': 'pagedown',
+    'home': 'home',
+    'end': 'end',
+    'insert': 'insert',
+    'delete': 'delete',
+    'caps_lock': 'capslock',
+    'num_lock': 'numlock',
+    'scroll_lock': 'scrolllock',
+    'print_screen': 'printscreen',
+    'pause': 'pause',
+    'f1': 'f1',
+    'f2': 'f2',
+    'f3': 'f3',
+    'f4': 'f4',
+    'f5': 'f5',
+    'f6': 'f6',
+    'f7': 'f7',
+    'f8': 'f8',
+    'f9': 'f9',
+    'f10': 'f10',
+    'f11': 'f11',
+    'f12': 'f12',
+}
+
+MOUSE_BUTTONS = ("left", "right", "middle")
+
+def pyautogui_key(key):
+    """pyautogui name for a recorded key"""
+    return KEY_MAPPING.get(key, key.lower())
+
+# One pre-resolved playback step: `run(args, gui_log, cancel)` performs it (None = no-op),
+# `delay` is the recorded gap before it and `ev` the source event.
+PlaybackOp = namedtuple("PlaybackOp", ["kind", "delay", "run", "args", "ev"])
+
+# An event's template as a plan stores it. It is resolved through TEMPLATE_CACHE
+# each time the op runs, so a re-captured file is reloaded (mtime check) and
+# the cache statistics stay meaningful; `digest` spares rehashing inline ones.
+TemplateRef = namedtuple("TemplateRef", ["info", "color", "digest"])
+
+def _compile_template(ev):
+    """An event's template as (TemplateRef, radii override), or (None, None)"""
     tpl_info = ev.get("template")
-    
-    # try match by template
-    if tpl_info:
-        tpl_bgr = None
-        if isinstance(tpl_info, dict) and tpl_info.get("bgr") is not None:
-            try:
-                tpl_bgr = np.array(tpl_info["bgr"], dtype=np.uint8)
-            except Exception:
-                tpl_bgr = None
-        elif isinstance(tpl_info, str) and os.path.exists(tpl_info):
-            tpl_bgr = load_template_from_file(tpl_info)
-        if tpl_bgr is not None:
-            # try fullscreen then expanding radii
-            cx, cy, sc = match_template_search(tpl_bgr, bbox=None)
-            if cx is not None:
-                if button == "left":
-                    pyautogui.click(cx, cy)
-                elif button == "right":
-                    pyautogui.click(cx, cy, button='right')
-                elif button == "middle":
-                    pyautogui.click(cx, cy, button='middle')
-                if gui_log: gui_log(f"{button.upper()} CLICK matched at {cx},{cy} score={sc:.3f}")
-                return
-            # else retry radii around recorded pos if available
-            if pos:
-                for r in RETRY_RADII:
-                    bbox = (pos[0]-r, pos[1]-r, r*2, r*2)
-                    cx, cy, sc = match_template_search(tpl_bgr, bbox=bbox)
-                    if cx is not None:
-                        if button == "left":
-                            pyautogui.click(cx, cy)
-                        elif button == "right":
-                            pyautogui.click(cx, cy, button='right')
-                        elif button == "middle":
-                            pyautogui.click(cx, cy, button='middle')
-                        if gui_log: gui_log(f"{button.upper()} CLICK matched near pos at {cx},{cy} score={sc:.3f}")
-                        return
+    if not tpl_info:
+        return None, None
+    digest = None
+    if isinstance(tpl_info, dict) and tpl_info.get("bgr") is not None:
+        try:
+            digest = inline_template_digest(tpl_info["bgr"])
+        except Exception:
+            logging.exception("invalid inline template")
+            return None, None
+    ref = TemplateRef(tpl_info, bool(ev.get("match_color", False)), digest)
+    return ref, ev.get("search_radii") or RETRY_RADII
+
+def resolve_template(ref):
+    """Template array for a TemplateRef at run time, or None"""
+    if ref is None:
+        return None
+    return TEMPLATE_CACHE.get(ref.info, color=ref.color, digest=ref.digest)
+
+def compile_event(ev):
+    """Turn a recorded event into a PlaybackOp"""
+    kind = ev.get("type")
+    delay = max(0.0, float(ev.get("delay", 0.0) or 0.0))
+    if kind == "click":
+        button = ev.get("button", "left")
+        pos = ev.get("pos")
+        pos = (int(pos[0]), int(pos[1])) if pos else None
+        if button in MOUSE_BUTTONS:
+            tpl, radii = _compile_template(ev)
+            return PlaybackOp(kind, delay, _run_click, (pos, button, tpl, radii), ev)
+    elif kind == "drag":
+        button = ev.get("button", "left")
+        start = (int(ev["start"][0]), int(ev["start"][1]))
+        end = (int(ev["end"][0]), int(ev["end"][1]))
+        if button in MOUSE_BUTTONS:
+            tpl, radii = _compile_template(ev)
+            path = None
+            samples = ev.get("samples") or []
+            if samples:
+                if isinstance(samples, SampleView) and samples.style == "b":
+                    xs, ys, dts = samples.arrays()
+                    xs, ys = xs.astype(np.int64), ys.astype(np.int64)
+                else:
+                    n = len(samples)
+                    xs = np.fromiter((s["x"] for s in samples), dtype=np.int64, count=n)
+                    ys = np.fromiter((s["y"] for s in samples), dtype=np.int64, count=n)
+                    dts = np.fromiter((s.get("dt", 0.01) for s in samples), dtype=np.float64, count=n)
+                # offsets from the recorded start, applied to the located start
+                path = (xs[1:] - xs[0], ys[1:] - ys[0], np.maximum(dts[1:], 0.001))
+            duration = max(0.01, ev.get("duration", 0.2))
+            return PlaybackOp(kind, delay, _run_drag,
+                              (start, end, button, tpl, radii, path, duration), ev)
+    elif kind in ("key_press", "key_release"):
+        key = ev.get("key")
+        if key:
+            return PlaybackOp(kind, delay, _run_key,
+                              (pyautogui_key(key), kind == "key_press", key), ev)
+    return PlaybackOp(kind, delay, None, (), ev)
+
+def compile_plan(evts):
+    """Compile events into an immutable tuple of PlaybackOps"""
+    plan = []
+    for ev in evts:
+        try:
+            plan.append(compile_event(ev))
+        except Exception:
+            logging.exception(f"cannot compile event {ev}")
+            plan.append(PlaybackOp(ev.get("type"), 0.0, None, (), ev))
+    return tuple(plan)
+
+_plan_lock = threading.Lock()
+_plan_cache = ()
+
+def playback_plan(evts):
+    """Compiled plan for `evts`, reused while its events are unchanged"""
+    global _plan_cache
+    with _plan_lock:
+        plan = _plan_cache
+        if len(plan) == len(evts) and all(op.ev is ev for op, ev in zip(plan, evts)):
+            return plan
+        plan = compile_plan(evts)
+        _plan_cache = plan
+        return plan
+
+PlaybackTiming = namedtuple("PlaybackTiming", ["speed", "max_gap", "drag_speed"])
+NORMAL_TIMING = PlaybackTiming(1.0, None, 1.0)
+
+def playback_timing(speed=1.0, max_gap=None, drag_speed=1.0):
+    """Validated PlaybackTiming; a falsy `max_gap` leaves idle gaps uncapped"""
+    speed, drag_speed = float(speed), float(drag_speed)
+    if speed <= 0 or drag_speed <= 0:
+        raise ValueError("speed factors must be positive")
+    max_gap = float(max_gap) if max_gap else None
+    if max_gap is not None and max_gap < 0:
+        raise ValueError("max gap must not be negative")
+    return PlaybackTiming(speed, max_gap, drag_speed)
+
+def format_duration(seconds):
+    seconds = max(0.0, seconds)
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    m, s = divmod(int(round(seconds)), 60)
+    h, m = divmod(m, 60)
+    return f"{h}h {m:02d}m {s:02d}s" if h else f"{m}m {s:02d}s"
+
+_timed_cache = (None, None, ())
+
+def retime_plan(plan, timing):
+    """Plan with delays and drag timing rescaled by `timing`.
+
+    Gaps are capped at `max_gap` and divided by `speed`; drag sample times
+    and durations are divided by `drag_speed`. The result is a plain plan,
+    so the scheduler and runners pay nothing per event; it is cached for
+    the last (plan, timing) pair.
+    """
+    global _timed_cache
+    if timing is None or timing == NORMAL_TIMING:
+        return plan
+    cached_plan, cached_timing, timed = _timed_cache
+    if cached_plan is plan and cached_timing == timing:
+        return timed
+    ops = []
+    for op in plan:
+        delay = op.delay if timing.max_gap is None else min(op.delay, timing.max_gap)
+        op = op._replace(delay=delay / timing.speed)
+        if op.kind == "drag" and op.run is not None and timing.drag_speed != 1.0:
+            start, end, button, tpl, radii, path, duration = op.args
+            if path is not None:
+                path = (path[0], path[1], path[2] / timing.drag_speed)
+            op = op._replace(args=(start, end, button, tpl, radii, path,
+                                   duration / timing.drag_speed))
+        ops.append(op)
+    timed = tuple(ops)
+    _timed_cache = (plan, timing, timed)
+    return timed
+
+def plan_runtime(plan, profile=None):
+    """Projected seconds for one pass: waits, drag motion and input cost.
+
+    Deadlines are absolute, so an op's injection cost (from `profile`, the
+    calibrated InputProfile) only adds time where it overruns the next gap.
+    """
+    profile = profile or input_profile()
+    deadline = end = 0.0
+    for op in plan:
+        deadline += op.delay
+        end = max(end, deadline) + op_cost(op, profile)
+        if op.kind == "drag" and op.run is not None:
+            path, duration = op.args[5], op.args[6]
+            end += float(path[2].sum()) if path is not None else duration
+    return end
+
+def run_op(op, gui_log=None, cancel=None):
+    """Execute one compiled op; `cancel` defaults to the current playback's token"""
+    if op.run is not None:
+        try:
+            op.run(op.args, gui_log, PLAYBACK_STOP if cancel is None else cancel)
+        finally:
+            input_backend().flush()
+
+def _run_click(args, gui_log, cancel):
+    pos, button, ref, radii = args
+    tpl = resolve_template(ref)
+    if tpl is not None:
+        # recorded neighbourhood first, widening, full screen last
+        cx, cy, sc, r = locate_template(tpl, pos, radii, cancel=cancel)
+        if cx is not None:
+            input_backend().click(cx, cy, button)
+            where = "at" if r is None else f"near pos (r={r}) at"
+            if gui_log: gui_log(f"{button.upper()} CLICK matched {where} {cx},{cy} score={sc:.3f}")
+            return
     # fallback to raw pos
     if pos:
-        if button == "left":
-            pyautogui.click(pos[0], pos[1])
-        elif button == "right":
-            pyautogui.click(pos[0], pos[1], button='right')
-        elif button == "middle":
-            pyautogui.click(pos[0], pos[1], button='middle')
+        input_backend().click(pos[0], pos[1], button)
         if gui_log: gui_log(f"{button.upper()} CLICK fallback at {pos}")
 
-def play_drag_event(ev, gui_log=None):
-    start = ev.get("start")
-    end = ev.get("end")
-    button = ev.get("button", "left")
-    tpl_info = ev.get("template")
+def _run_drag(args, gui_log, cancel):
+    start, end, button, ref, radii, path, duration = args
+    tpl = resolve_template(ref)
 
     # find corrected start:
     corrected = None
-    tpl_bgr = None
-    if tpl_info:
-        if isinstance(tpl_info, dict) and tpl_info.get("bgr") is not None:
-            try:
-                tpl_bgr = np.array(tpl_info["bgr"], dtype=np.uint8)
-            except Exception:
-                tpl_bgr = None
-        elif isinstance(tpl_info, str) and os.path.exists(tpl_info):
-            tpl_bgr = load_template_from_file(tpl_info)
-
-    if tpl_bgr is not None:
-        # try full then radii
-        cx, cy, sc = match_template_search(tpl_bgr, bbox=None)
-        if cx is not None:
-            corrected = (cx, cy)
-        else:
-            for r in RETRY_RADII:
-                bbox = (start[0]-r, start[1]-r, r*2, r*2)
-                cx, cy, sc = match_template_search(tpl_bgr, bbox=bbox)
-                if cx is not None:
-                    corrected = (cx, cy)
-                    break
+    with FRAME_PROVIDER.pinned():
+        if tpl is not None:
+            cx, cy, sc, _ = locate_template(tpl, start, radii, cancel=cancel)
+            if cx is not None:
+                corrected = (cx, cy)
 
-    if corrected is None:
-        # fallback: approximate start by pixel color
-        color = get_pixel_color(start[0], start[1])
-        corrected = find_color_near_simple(start[0], start[1], color, radius=10)
         if corrected is None:
-            logging.warning("play_drag_event: cannot locate start; aborting drag")
-            if gui_log: gui_log(f"{button.upper()} DRAG aborted: start not found")
-            return
+            # fallback: approximate start by pixel color
+            color = get_pixel_color(start[0], start[1])
+            corrected = find_color_near_simple(start[0], start[1], color, radius=10)
+            if corrected is None:
+                logging.warning("play_drag_event: cannot locate start; aborting drag")
+                if gui_log: gui_log(f"{button.upper()} DRAG aborted: start not found")
+                return
 
     sx, sy = corrected
-    # play samples
-    samples = ev.get("samples", [])
-    if not samples:
-        # fallback: native dragTo
+    inp = input_backend()
+    if path is None:
+        # fallback: straight line over the recorded duration
         try:
-            pyautogui.moveTo(sx, sy)
-            if button == "left":
-                pyautogui.mouseDown(button='left')
-                pyautogui.dragTo(end[0], end[1], duration=max(0.01, ev.get("duration", 0.2)), button='left')
-                pyautogui.mouseUp(button='left')
-            elif button == "right":
-                pyautogui.mouseDown(button='right')
-                pyautogui.dragTo(end[0], end[1], duration=max(0.01, ev.get("duration", 0.2)), button='right')
-                pyautogui.mouseUp(button='right')
-            elif button == "middle":
-                pyautogui.mouseDown(button='middle')
-                pyautogui.dragTo(end[0], end[1], duration=max(0.01, ev.get("duration", 0.2)), button='middle')
-                pyautogui.mouseUp(button='middle')
-            if gui_log: gui_log(f"{button.upper()} DRAG fallback dragTo executed")
-            return
-        except Exception as e:
-            logging.exception("play_drag_event fallback dragTo exception")
-            return
+            inp.move(sx, sy)
+            inp.button(button, True)
+            inp.flush()
+            try:
+                move_interruptible(sx, sy, end[0], end[1], duration, cancel=cancel)
+            finally:
+                inp.button(button, False)
+            if gui_log: gui_log(f"{button.upper()} DRAG fallback line executed")
+        except Exception:
+            logging.exception("play_drag_event fallback drag exception")
+        return
 
-    # original start in samples[0]
-    orig_x = samples[0]["x"]
-    orig_y = samples[0]["y"]
+    dx, dy, dts = path
+    inp.move(sx, sy)
+    inp.button(button, True)
+    inp.flush()
+    try:
+        replay_path(list(zip((dx + sx).tolist(), (dy + sy).tolist())), dts.tolist(), cancel)
+        inp.move(end[0], end[1], pause=False)
+    finally:
+        # never leave the button down, also when stopped mid-drag
+        inp.button(button, False)
 
-    pyautogui.moveTo(sx, sy)
-    
-    # Mouse down with correct button
-    if button == "left":
-        pyautogui.mouseDown(button='left')
-    elif button == "right":
-        pyautogui.mouseDown(button='right')
-    elif button == "middle":
-        pyautogui.mouseDown(button='middle')
-    
-    for s in samples[1:]:
-        dx = s["x"] - orig_x
-        dy = s["y"] - orig_y
-        tx = int(round(sx + dx))
-        ty = int(round(sy + dy))
-        dt = max(0.001, float(s.get("dt", 0.01)))
-        try:
-            pyautogui.moveTo(tx, ty, duration=dt)
-        except Exception:
-            pyautogui.moveTo(tx, ty)
-    
-    pyautogui.moveTo(end[0], end[1])
-    
-    # Mouse up with correct button
-    if button == "left":
-        pyautogui.mouseUp(button='left')
-    elif button == "right":
-        pyautogui.mouseUp(button='right')
-    elif button == "middle":
-        pyautogui.mouseUp(button='middle')
-    
     if gui_log: gui_log(f"{button.upper()} DRAG executed to {end}")
 
-def play_key_event(ev, gui_log=None):
-    """Play keyboard key press/release event"""
-    key = ev.get("key")
-    event_type = ev.get("type")
-    
-    if not key:
-        return
-    
+def _run_key(args, gui_log, cancel):
+    name, down, key = args
     try:
-        # Map special keys to pyautogui format
-        key_mapping = {
-            'space': 'space',
-            'enter': 'enter',
-            'tab': 'tab',
-            'backspace': 'backspace',
-            'esc': 'esc',
-            'shift': 'shift',
-            'ctrl': 'ctrl',
-            'alt': 'alt',
-            'cmd': 'win' if sys.platform == 'win32' else 'command',
-            'win': 'win',
-            'up': 'up',
-            'down': 'down',
-            'left': 'left',
-            'right': 'right',
-            'page_up': 'pageup',
-            'page_down': 'pagedown',
-            'home': 'home',
-            'end': 'end',
-            'insert': 'insert',
-            'delete': 'delete',
-            'caps_lock': 'capslock',
-            'num_lock': 'numlock',
-            'scroll_lock': 'scrolllock',
-            'print_screen': 'printscreen',
-            'pause': 'pause',
-            'f1': 'f1',
-            'f2': 'f2',
-            'f3': 'f3',
-            'f4': 'f4',
-            'f5': 'f5',
-            'f6': 'f6',
-            'f7': 'f7',
-            'f8': 'f8',
-            'f9': 'f9',
-            'f10': 'f10',
-            'f11': 'f11',
-            'f12': 'f12',
-        }
-        
-        # Convert key to pyautogui format
-        if key in key_mapping:
-            pyautogui_key = key_mapping[key]
-        elif len(key) == 1:  # Single character
-            pyautogui_key = key.lower()
-        else:
-            pyautogui_key = key.lower()
-        
-        if event_type == "key_press":
-            pyautogui.keyDown(pyautogui_key)
+        if down:
+            input_backend().key(name, True)
+            HELD_KEYS.press(name)
             if gui_log: gui_log(f"KEY DOWN: {key}")
-        elif event_type == "key_release":
-            pyautogui.keyUp(pyautogui_key)
+        else:
+            input_backend().key(name, False)
+            HELD_KEYS.release(name)
             if gui_log: gui_log(f"KEY UP: {key}")
-            
-    except Exception as e:
+    except Exception:
         logging.exception(f"Error playing key event: {key}")
         if gui_log: gui_log(f"Error playing key: {key}")
 
-def find_color_near_simple(x, y, color, radius=10):
-    target_r, target_g, target_b = color
-    radii = [radius, radius*2, radius*3]
-    for rad in radii:
-        left = max(0, x-rad)
-        top = max(0, y-rad)
-        w = rad*2
-        h = rad*2
-        img = screenshot_region_pil(left, top, w, h)
-        if img is None:
-            continue
-        for dx in range(img.width):
-            for dy in range(img.height):
-                r,g,b = img.getpixel((dx,dy))
-                if abs(r-target_r) <= 4 and abs(g-target_g) <= 4 and abs(b-target_b) <= 4:
-                    return (left+dx, top+dy)
-    return None
+# -----------------------
+# Input backends
+# -----------------------
+class PyAutoGUIInput:
+    """Default input backend: pyautogui calls, each followed by
+    pyautogui.PAUSE unless made with pause=False.
+    """
+    name = "pyautogui"
+
+    @property
+    def version(self):
+        return getattr(pyautogui, "__version__", "?")
+
+    @property
+    def pause_s(self):
+        return float(pyautogui.PAUSE)
+
+    def position(self):
+        x, y = pyautogui.position()
+        return x, y
+
+    def size(self):
+        w, h = pyautogui.size()
+        return w, h
+
+    def move(self, x, y, pause=True):
+        pyautogui.moveTo(x, y, _pause=pause)
+
+    def click(self, x, y, button="left"):
+        pyautogui.click(x, y, button=button)
+
+    def button(self, button, down, pause=True):
+        if down:
+            pyautogui.mouseDown(button=button, _pause=pause)
+        else:
+            pyautogui.mouseUp(button=button, _pause=pause)
+
+    def key(self, name, down, pause=True):
+        if down:
+            pyautogui.keyDown(name, _pause=pause)
+        else:
+            pyautogui.keyUp(name, _pause=pause)
+
+    def flush(self):
+        pass
+
+# pyautogui key names whose X keysym is spelled differently
+XTEST_KEYSYMS = {
+    "enter": "Return", "return": "Return", "esc": "Escape", "escape": "Escape",
+    "backspace": "BackSpace", "tab": "Tab", "space": "space", "delete": "Delete",
+    "del": "Delete", "insert": "Insert", "home": "Home", "end": "End",
+    "pageup": "Prior", "pagedown": "Next", "up": "Up", "down": "Down",
+    "left": "Left", "right": "Right", "capslock": "Caps_Lock", "numlock": "Num_Lock",
+    "scrolllock": "Scroll_Lock", "printscreen": "Print", "pause": "Pause",
+    "shift": "Shift_L", "shiftleft": "Shift_L", "shiftright": "Shift_R",
+    "ctrl": "Control_L", "ctrlleft": "Control_L", "ctrlright": "Control_R",
+    "alt": "Alt_L", "altleft": "Alt_L", "altright": "Alt_R",
+    "win": "Super_L", "winleft": "Super_L", "winright": "Super_R", "menu": "Menu",
+}
+
+class XTestInput:
+    """Input sent straight through the X Test extension (python-xlib).
+
+    Calls only queue requests on the display connection and flush() sends
+    them; the runners flush once per op or drag sample. There is no
+    per-call pause. Linux/X11 only; use from one thread at a time.
+    """
+    name = "xtest"
+    pause_s = 0.0
+    BUTTONS = {"left": 1, "middle": 2, "right": 3}
+
+    def __init__(self, display_name=None):
+        import Xlib
+        from Xlib import X, XK, display
+        from Xlib.ext import xtest
+        self.version = ".".join(str(v) for v in Xlib.__version__)
+        self._X, self._XK, self._xtest = X, XK, xtest
+        self.display = display.Display(display_name)
+        if self.display.query_extension("XTEST") is None:
+            self.display.close()
+            raise RuntimeError("the X server has no XTEST extension")
+        self._keycodes = {}
+
+    def position(self):
+        pointer = self.display.screen().root.query_pointer()
+        return pointer.root_x, pointer.root_y
+
+    def size(self):
+        screen = self.display.screen()
+        return screen.width_in_pixels, screen.height_in_pixels
+
+    def move(self, x, y, pause=True):
+        self._xtest.fake_input(self.display, self._X.MotionNotify, x=int(x), y=int(y))
+
+    def click(self, x, y, button="left"):
+        self.move(x, y)
+        self.button(button, True)
+        self.button(button, False)
+
+    def button(self, button, down, pause=True):
+        kind = self._X.ButtonPress if down else self._X.ButtonRelease
+        self._xtest.fake_input(self.display, kind, self.BUTTONS[button])
+
+    def key(self, name, down, pause=True):
+        kind = self._X.KeyPress if down else self._X.KeyRelease
+        self._xtest.fake_input(self.display, kind, self.keycode(name))
+
+    def keycode(self, name):
+        code = self._keycodes.get(name)
+        if code is None:
+            if len(name) > 1 and name[0] == "f" and name[1:].isdigit():
+                sym = self._XK.string_to_keysym(name.upper())
+            elif len(name) == 1:
+                sym = ord(name)  # Latin-1 keysyms equal their code point
+            else:
+                sym = self._XK.string_to_keysym(XTEST_KEYSYMS.get(name, name))
+            code = self.display.keysym_to_keycode(sym) if sym else 0
+            if not code:
+                raise ValueError(f"no X keycode for key {name!r}")
+            self._keycodes[name] = code
+        return code
+
+    def flush(self):
+        self.display.flush()
+
+INPUT_BACKENDS = {"pyautogui": PyAutoGUIInput, "xtest": XTestInput}
+_input_backend = None
+
+def input_backend():
+    """The active input backend, created from INPUT_BACKEND on first use"""
+    if _input_backend is None:
+        set_input_backend(INPUT_BACKEND)
+    return _input_backend
+
+def set_input_backend(name, fallback=True):
+    """Inject input through backend `name`.
+
+    If it cannot start, falls back to pyautogui, or re-raises with `fallback` False.
+    """
+    global _input_backend, _input_profile
+    try:
+        backend = INPUT_BACKENDS[name]()
+    except Exception as e:
+        if not fallback:
+            raise
+        logging.warning(f"Input backend {name!r} unavailable ({e}); using pyautogui")
+        backend = PyAutoGUIInput()
+    if _input_backend is None or backend.name != _input_backend.name:
+        _input_profile = None  # calibration profiles are per backend
+    _input_backend = backend
+    logging.info(f"Input backend: {backend.name} {backend.version}")
+    return backend
+
+# -----------------------
+# Input calibration
+# -----------------------
+InputProfile = namedtuple("InputProfile", ["move_s", "button_s", "key_s", "pause_s"])
+ZERO_INPUT_COST = InputProfile(0.0, 0.0, 0.0, 0.0)
+_input_profile = None
+
+def input_backend_id():
+    """Identifies the injection backend a profile was measured on"""
+    backend = input_backend()
+    return f"{backend.name} {backend.version} {sys.platform} {os.environ.get('DISPLAY', '')}".strip()
+
+def _median_call(fn, calls):
+    """Median seconds per fn() call"""
+    times = []
+    for i in range(calls):
+        t = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return times[len(times) // 2]
+
+def calibrate_input(calls=INPUT_CALIBRATION_CALLS, save=True, keys=False):
+    """Measure the per-call cost of input injection on this backend.
+
+    Only run on request: the pointer is nudged by one pixel and back.
+    Buttons are not pressed (that would click whatever is under the
+    pointer) and neither are keys unless `keys` is set, since repeated
+    Shift taps trigger Sticky Keys or IDE shortcuts; a press is one
+    platform call like a move, so the move cost stands in for them.
+    `pause_s` is the backend's fixed sleep after every call not made
+    with pause=False.
+    """
+    global _input_profile
+    inp = input_backend()
+    x, y = inp.position()
+    nx = x + 1 if x + 1 < inp.size()[0] else x - 1
+
+    def move(i):
+        inp.move(nx if i % 2 == 0 else x, y, pause=False)
+        inp.flush()
+
+    def tap(i):
+        inp.key("shift", True, pause=False)
+        inp.key("shift", False, pause=False)
+        inp.flush()
+
+    try:
+        move_s = _median_call(move, calls)
+    finally:
+        inp.move(x, y, pause=False)
+        inp.flush()
+    key_s = _median_call(tap, calls) / 2 if keys else move_s
+    profile = InputProfile(round(move_s, 6), round(move_s, 6), round(key_s, 6), inp.pause_s)
+    _input_profile = profile
+    logging.info(f"Input calibration ({input_backend_id()}): move {move_s * 1000:.2f} ms, "
+                 f"key {key_s * 1000:.2f} ms, pause {profile.pause_s * 1000:.0f} ms per call")
+    if save:
+        try:
+            save_input_profile(profile)
+        except OSError:
+            logging.exception("Could not save the input profile")
+    return profile
+
+def save_input_profile(profile):
+    data = dict(profile._asdict(), backend=input_backend_id(),
+                calibrated=datetime.now().isoformat(timespec="seconds"))
+
+    def write(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+    atomic_write(INPUT_PROFILE_FILE, write)
+
+def load_input_profile():
+    """Stored InputProfile, or None if missing or measured on another backend"""
+    try:
+        with open(INPUT_PROFILE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("backend") != input_backend_id():
+            return None
+        return InputProfile(*(float(data[k]) for k in InputProfile._fields))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+def input_profile():
+    """The InputProfile in use: cached or loaded from disk.
+
+    Never measures: without a stored profile (see calibrate_input) input
+    counts as zero cost.
+    """
+    global _input_profile
+    if _input_profile is None:
+        _input_profile = load_input_profile() or ZERO_INPUT_COST
+    return _input_profile
+
+def op_cost(op, profile):
+    """Seconds `op` spends injecting input (drag motion excluded)"""
+    p = profile
+    if op.run is None:
+        return 0.0
+    if op.kind == "click":
+        return p.move_s + 2 * p.button_s + p.pause_s
+    if op.kind == "drag":
+        # moveTo + mouseDown + mouseUp with a pause each, final moveTo without
+        return 2 * p.move_s + 2 * p.button_s + 3 * p.pause_s
+    if op.kind in ("key_press", "key_release"):
+        return p.key_s + p.pause_s
+    return 0.0
+
+# -----------------------
+# Playback scheduler
+# -----------------------
+class PlaybackCancelled(BaseException):
+    """Raised from inside an input step once playback has been stopped.
+
+    Derives from BaseException, like KeyboardInterrupt, so the per-event
+    `except Exception` handlers let it through to the worker.
+    """
+
+class CancelToken:
+    """Stop request for one playback run; waits on it wake up immediately"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.requested_at = None  # perf_counter() of the first cancel()
+
+    def cancel(self):
+        if self.requested_at is None:
+            self.requested_at = time.perf_counter()
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Sleep up to `seconds`; returns True as soon as a stop is requested"""
+        if seconds <= 0:
+            return self._event.is_set()
+        return self._event.wait(seconds)
+
+    def check(self):
+        """Raise PlaybackCancelled if a stop was requested"""
+        if self._event.is_set():
+            raise PlaybackCancelled()
+
+PLAYBACK_STOP = CancelToken()
+
+def begin_playback():
+    """Cancel any run still winding down and install a fresh stop token"""
+    global PLAYBACK_STOP
+    PLAYBACK_STOP.cancel()
+    PLAYBACK_STOP = CancelToken()
+    return PLAYBACK_STOP
+
+def stop_playback():
+    """Ask the running playback to stop"""
+    PLAYBACK_STOP.cancel()
+
+class HeldKeys:
+    """Keys pressed by playback and not released yet"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = set()
+
+    def press(self, name):
+        with self._lock:
+            self._keys.add(name)
+
+    def release(self, name):
+        with self._lock:
+            self._keys.discard(name)
+
+    def release_all(self):
+        """keyUp every key still held; returns their names"""
+        with self._lock:
+            keys, self._keys = sorted(self._keys), set()
+        inp = input_backend()
+        for name in keys:
+            try:
+                inp.key(name, False)
+            except Exception:
+                logging.exception(f"Could not release held key {name!r}")
+        inp.flush()
+        return keys
+
+HELD_KEYS = HeldKeys()
+
+def replay_path(points, dts, cancel=None):
+    """Move through `points`, reaching each `dts[i]` seconds after the previous.
+
+    Moves are instant and run on absolute deadlines, issued early by the
+    calibrated move cost. When moves cost more than the sample spacing,
+    samples already due are skipped, so the motion lasts as long as the
+    recording whatever the backend overhead. Raises PlaybackCancelled once
+    `cancel` is set.
+    """
+    inp = input_backend()
+    lead = input_profile().move_s
+    deadlines = []
+    t = time.perf_counter()
+    for dt in dts:
+        t += max(0.0, dt)
+        deadlines.append(t - lead)
+    n = len(deadlines)
+    started, skipped, i = time.perf_counter(), 0, 0
+    while i < n:
+        now = time.perf_counter()
+        while i + 1 < n and deadlines[i + 1] <= now:
+            i += 1
+            skipped += 1
+        if not sleep_until(deadlines[i], cancel):
+            raise PlaybackCancelled()
+        x, y = points[i]
+        inp.move(x, y, pause=False)
+        inp.flush()
+        i += 1
+    if n:
+        logging.debug(f"path replay {time.perf_counter() - started:.3f}s for "
+                      f"{sum(dts):.3f}s recorded, {skipped}/{n} samples skipped")
+
+def move_interruptible(x0, y0, x1, y1, duration, tween=None, cancel=None):
+    """Move the pointer from (x0, y0) to (x1, y1) over `duration` seconds.
+
+    The line (eased by `tween`) is replayed in CANCEL_SLICE steps, so Stop
+    lands within one step. Raises PlaybackCancelled once `cancel` is set.
+    """
+    steps = max(1, ceil(duration / CANCEL_SLICE))
+    points = []
+    for k in range(1, steps):
+        f = tween(k / steps) if tween is not None else k / steps
+        points.append((round(x0 + (x1 - x0) * f), round(y0 + (y1 - y0) * f)))
+    points.append((x1, y1))
+    replay_path(points, [duration / steps] * steps, cancel)
+
+def finish_playback(cancel, gui_log=None):
+    """Release keys the run left held and report how fast a stop took effect.
+
+    Returns the stop latency in ms, or None if the run was not stopped.
+    """
+    held = HELD_KEYS.release_all()
+    if held:
+        logging.info(f"Released held keys: {', '.join(held)}")
+    if cancel.requested_at is None:
+        return None
+    latency = (time.perf_counter() - cancel.requested_at) * 1000.0
+    logging.info(f"Playback stopped {latency:.1f} ms after the stop request")
+    if gui_log: gui_log(f"Playback stopped {latency:.1f} ms after the stop request")
+    return latency
+
+def sleep_until(deadline, cancel=None, spin=SCHEDULER_SPIN):
+    """Sleep until time.perf_counter() reaches `deadline`.
+
+    The coarse part waits on the `cancel` token (CancelToken), so Stop wakes
+    it at once; the last `spin` seconds are spun. Returns False if stopped.
+    """
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return True
+        if cancel is not None and cancel.cancelled:
+            return False
+        if remaining > spin:
+            if cancel is not None:
+                cancel.wait(remaining - spin)
+            else:
+                time.sleep(remaining - spin)
+        else:
+            time.sleep(0)
+
+class DeadlineScheduler:
+    """Absolute-deadline timeline for events carrying relative "delay"s.
+
+    Deadlines are computed once from the cumulative delays, so time spent
+    matching and clicking is absorbed by the next wait instead of piling up.
+    """
+
+    def __init__(self, delays):
+        self.offsets = []
+        t = 0.0
+        for d in delays:
+            t += max(0.0, float(d or 0.0))
+            self.offsets.append(t)
+        self.t0 = None
+        self.lateness = []
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self.lateness = []
+
+    def wait(self, index, cancel=None):
+        """Wait for event `index`; returns its lateness in seconds, or None if stopped"""
+        if self.t0 is None:
+            self.start()
+        deadline = self.t0 + self.offsets[index]
+        if not sleep_until(deadline, cancel):
+            return None
+        late = time.perf_counter() - deadline
+        self.lateness.append(late)
+        return late
+
+    def summary(self):
+        """One-line lateness report for the log"""
+        if not self.lateness:
+            return "no events"
+        worst = max(self.lateness) * 1000.0
+        mean = sum(self.lateness) / len(self.lateness) * 1000.0
+        return f"{len(self.lateness)} events, late max={worst:.1f} ms mean={mean:.1f} ms"
 
 # -----------------------
 # Playback controller
 # -----------------------
-def playback_worker(delay_start, repeat_minutes, status_label, gui_log):
+def playback_worker(delay_start, repeat_minutes, status_label, gui_log, timing=None, cancel=None):
+    # Token tego przebiegu (z begin_playback() wywołującego, nie globalny: wątek,
+    # który wystartuje później, nie może przejąć tokenu nowszego przebiegu);
+    # stop_playback() budzi każde czekanie natychmiast
+    cancel = PLAYBACK_STOP if cancel is None else cancel
+    # Koszt wstrzykiwania zdarzeń z zapisanej kalibracji (zero bez kalibracji)
+    profile = input_profile()
+    # Prognoza czasu jednego przebiegu (z uwzględnieniem `timing`)
+    projected = plan_runtime(retime_plan(playback_plan(events.copy()), timing), profile)
+    if gui_log: gui_log(f"Projected runtime: {format_duration(projected)} per pass")
     if delay_start > 0:
         for s in range(delay_start, 0, -1):
-            if not getattr(playback_worker, "running", True):
-                status_label.config(text="Stopped")
-                return
+            if cancel.cancelled:
+                break
             status_label.config(text=f"Starting in {s}s")
-            time.sleep(1)
+            cancel.wait(1)
 
-    while getattr(playback_worker, "running", True):
+    while not cancel.cancelled:
         status_label.config(text="Playing...")
-        snapshot = events.copy()
-        for ev in snapshot:
-            if not getattr(playback_worker, "running", True):
-                break
+        plan = retime_plan(playback_plan(events.copy()), timing)
+        scheduler = DeadlineScheduler(op.delay for op in plan)
+        scheduler.start()
+        for i, op in enumerate(plan):
             try:
-                d = ev.get("delay", 0.0)
-                if d > 0:
-                    time.sleep(d)
-                
-                if ev["type"] == "click":
-                    play_click_event(ev, gui_log=gui_log)
-                elif ev["type"] == "drag":
-                    play_drag_event(ev, gui_log=gui_log)
-                elif ev["type"] in ["key_press", "key_release"]:
-                    play_key_event(ev, gui_log=gui_log)
-                    
+                late = scheduler.wait(i, cancel)
+                if late is None:
+                    break
+                logging.debug(f"event {i} ({op.kind}) late by {late * 1000:.1f} ms")
+                run_op(op, gui_log, cancel)
+                # Ekran mógł się zmienić po każdym wstrzykniętym zdarzeniu
+                FRAME_PROVIDER.invalidate()
+            except PlaybackCancelled:
+                break
             except Exception:
                 logging.exception("Error during playback evt")
+        logging.info(f"Playback timing: {scheduler.summary()}")
+        if TEMPLATE_CACHE.hits or TEMPLATE_CACHE.misses:
+            logging.info(f"Template cache: {TEMPLATE_CACHE.stats()}")
         if repeat_minutes <= 0:
             break
         wait = repeat_minutes * 60
         for s in range(wait, 0, -1):
-            if not getattr(playback_worker, "running", True):
+            if cancel.cancelled:
                 break
             status_label.config(text=f"Next in {s}s")
-            time.sleep(1)
-    status_label.config(text="Ready")
-    global playing
-    playing = False
+            cancel.wait(1)
+    finish_playback(cancel, gui_log)
+    # Nowy przebieg mógł już wystartować - nie nadpisuj jego stanu
+    if PLAYBACK_STOP is cancel:
+        status_label.config(text="Ready")
+        global playing
+        playing = False
+
+# -----------------------
+# Events list view
+# -----------------------
+class EventListView:
+    """Virtualized events list: the Listbox only holds the visible rows.
+
+    `sync()` is a no-op while the list's identity, version and the scroll
+    window are unchanged; otherwise only the visible rows are formatted.
+    While scrolled to the bottom the view follows new events.
+    """
+
+    def __init__(self, parent, formatter, **listbox_options):
+        self.formatter = formatter  # (index, event) -> row text
+        self.frame = tk.Frame(parent, bg=listbox_options.get("bg"))
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.listbox = tk.Listbox(self.frame, **listbox_options)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.items = []
+        self.first = 0
+        self.follow = True
+        self._row_height = 16
+        self._key = None
+        self.listbox.bind("<Configure>", lambda e: self.render())
+        self.listbox.bind("<MouseWheel>", self._on_wheel)
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-3) or "break")
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(3) or "break")
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def invalidate(self):
+        """Re-format the visible rows on the next render"""
+        self._key = None
+
+    def sync(self, items):
+        """Show `items` (re-rendering only if something changed)"""
+        self.items = items
+        self.render()
+
+    def visible_rows(self):
+        first, second = self.listbox.bbox(0), self.listbox.bbox(1)
+        if first and second:
+            self._row_height = max(1, second[1] - first[1])
+        return max(1, self.listbox.winfo_height() // self._row_height)
+
+    def render(self):
+        items = self.items
+        n = len(items)
+        rows = self.visible_rows()
+        last_first = max(0, n - rows)
+        self.first = last_first if self.follow else min(self.first, last_first)
+        key = (id(items), getattr(items, "version", None), n, self.first, rows)
+        if key != self._key:
+            self._key = key
+            end = min(n, self.first + rows)
+            lines = [self.formatter(i, items[i]) for i in range(self.first, end)]
+            self.listbox.delete(0, tk.END)
+            if lines:
+                self.listbox.insert(tk.END, *lines)
+        if n:
+            self.scrollbar.set(self.first / n, min(1.0, (self.first + rows) / n))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll(self, delta):
+        self._scroll_to(self.first + delta)
+
+    def _scroll_to(self, first):
+        rows = self.visible_rows()
+        self.first = max(0, min(int(first), len(self.items) - rows))
+        self.follow = self.first + rows >= len(self.items)
+        self.render()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self._scroll_to(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.visible_rows()
+            self.scroll(amount)
+
+    def _on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+# -----------------------
+# UI update bus
+# -----------------------
+class UiBus:
+    """Thread-safe channel from worker threads to Tk widgets.
+
+    Workers post widget options and log lines; the Tk thread drains them on
+    one `after()` tick, keeping only the latest options per widget and
+    inserting all pending log lines at once.
+    """
+
+    def __init__(self, root, interval_ms=UI_BUS_INTERVAL_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.log_widget = None
+        self._lock = threading.Lock()
+        self._options = {}  # widget -> latest config() kwargs
+        self._lines = deque(maxlen=LOG_VIEW_MAX_LINES)
+        self._calls = []
+        self._job = None
+
+    def config(self, widget, **kwargs):
+        """Queue `widget.config(**kwargs)`; later values replace earlier ones"""
+        with self._lock:
+            self._options.setdefault(widget, {}).update(kwargs)
+
+    def log(self, line):
+        """Queue one line for the log view (only the newest LOG_VIEW_MAX_LINES are kept)"""
+        with self._lock:
+            self._lines.append(line)
+
+    def call(self, fn, *args):
+        """Queue `fn(*args)` to run on the Tk thread (dialogs, widget updates)"""
+        with self._lock:
+            self._calls.append((fn, args))
+
+    def label(self, widget):
+        """Proxy with a `config()` that goes through the bus, for worker threads"""
+        return BusLabel(self, widget)
+
+    def start(self):
+        if self._job is None:
+            self._job = self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        if self._job is not None:
+            try:
+                self.root.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+
+    def _drain(self):
+        with self._lock:
+            options, self._options = self._options, {}
+            calls, self._calls = self._calls, []
+            if self.log_widget is not None:
+                lines, self._lines = self._lines, deque(maxlen=LOG_VIEW_MAX_LINES)
+            else:
+                lines = []
+        for widget, kwargs in options.items():
+            try:
+                widget.config(**kwargs)
+            except tk.TclError:
+                pass  # widget already destroyed
+        if lines:
+            try:
+                self.log_widget.append_lines(lines)
+            except tk.TclError:
+                pass
+        for fn, args in calls:
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("UiBus call error")
+        self._job = self.root.after(self.interval_ms, self._drain)
+
+class BusLabel:
+    """Stand-in for a Tk label handed to worker threads"""
+
+    def __init__(self, bus, widget):
+        self.bus = bus
+        self.widget = widget
+
+    def config(self, **kwargs):
+        self.bus.config(self.widget, **kwargs)
+
+    configure = config
+
+class LogView:
+    """ScrolledText log that keeps only the last `max_lines` lines.
+
+    Lines arrive in batches from UiBus: one insert and one see() per batch.
+    Old lines are trimmed once the cap is exceeded by `trim_batch`, so
+    deletes are rare. The full history stays in the rotated LOG_FILE.
+    """
+
+    def __init__(self, parent, max_lines=LOG_VIEW_MAX_LINES, trim_batch=None, **text_options):
+        self.text = scrolledtext.ScrolledText(parent, **text_options)
+        self.max_lines = max_lines
+        self.trim_batch = trim_batch or max(1, max_lines // 10)
+        self.lines = 0
+
+    def pack(self, **kwargs):
+        self.text.pack(**kwargs)
+
+    def append_lines(self, lines):
+        """Append newline-terminated lines in one insert"""
+        chunk = "".join(lines)
+        if not chunk:
+            return
+        self.text.insert(tk.END, chunk)
+        self.lines += chunk.count("\n")
+        excess = self.lines - self.max_lines
+        if excess >= self.trim_batch:
+            self.text.delete("1.0", f"{excess + 1}.0")
+            self.lines -= excess
+        self.text.see(tk.END)
 
 # -----------------------
 # Compact Mode Window
@@ -898,6 +3358,14 @@ class MacroFlowMiniApp:
         self.root.geometry("700x600")
         self.root.configure(bg=COLORS["bg"])
         
+        # Status/log z wątków roboczych trafiają do Tk przez szynę
+        self.ui_bus = UiBus(self.root)
+        self.ui_bus.start()
+        self.writer = BackgroundWriter(notify=self.log)
+        atexit.register(self.writer.wait, SAVE_WAIT_TIMEOUT)
+        # .mfb a journaled recording is being compacted to; Play/Save wait for it
+        self.compacting = None
+        
         # Zmienna do śledzenia czy okno jest ukryte
         self.hidden_to_tray = False
         self.compact_window = None
@@ -1012,6 +3480,18 @@ class MacroFlowMiniApp:
                                                       activeforeground=COLORS["fg"])
         self.record_right_click_check.pack(side=tk.LEFT, padx=5)
         
+        # Nagrywanie strumieniowe do dziennika na dysku
+        self.journal_var = tk.BooleanVar(value=JOURNAL_RECORDING)
+        self.journal_check = tk.Checkbutton(options_frame,
+                                            text="Stream to disk",
+                                            variable=self.journal_var,
+                                            bg=COLORS["bg"],
+                                            fg=COLORS["fg"],
+                                            selectcolor=COLORS["card"],
+                                            activebackground=COLORS["bg"],
+                                            activeforeground=COLORS["fg"])
+        self.journal_check.pack(side=tk.LEFT, padx=5)
+        
         # ========== COMPACT CONTROLS ==========
         controls_frame = tk.Frame(self.main_tab, bg=COLORS["bg"])
         controls_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -1140,12 +3620,29 @@ class MacroFlowMiniApp:
                                     font=("Segoe UI", 9))
         self.repeat_entry.insert(0, "0")
         self.repeat_entry.pack(side=tk.LEFT, padx=5)
+
+        # Playback timing: speed factor, idle gap cap (0 = off), drag speed
+        self.speed_entry = self._add_setting(settings_frame, "Speed (x):", "1.0")
+        self.max_gap_entry = self._add_setting(settings_frame, "Max gap (s):", "0")
+        self.drag_speed_entry = self._add_setting(settings_frame, "Drag speed (x):", "1.0")
+        
+        # Koszt wstrzykiwania mierzony tylko na żądanie (kursor przesuwa się o piksel)
+        self.calibrate_btn = tk.Button(settings_frame,
+                 text="⏱ Calibrate input",
+                 bg=COLORS["secondary"],
+                 fg="white",
+                 font=("Segoe UI", 9),
+                 borderwidth=0,
+                 padx=8,
+                 pady=2,
+                 command=self.start_calibration)
+        self.calibrate_btn.pack(anchor=tk.W, pady=2)
         
         # Right control buttons (Save/Load)
         right_controls = tk.Frame(controls_frame, bg=COLORS["bg"])
         right_controls.pack(side=tk.RIGHT, fill=tk.Y)
         
-        tk.Button(right_controls,
+        self.save_btn = tk.Button(right_controls,
                  text="💾 Save",
                  bg=COLORS["secondary"],
                  fg="white",
@@ -1153,7 +3650,8 @@ class MacroFlowMiniApp:
                  borderwidth=0,
                  padx=12,
                  pady=6,
-                 command=self.save_file).pack(side=tk.LEFT, padx=2, pady=(0, 10))
+                 command=self.save_file)
+        self.save_btn.pack(side=tk.LEFT, padx=2, pady=(0, 10))
         
         tk.Button(right_controls,
                  text="📂 Load",
@@ -1180,13 +3678,15 @@ class MacroFlowMiniApp:
                 font=("Segoe UI", 10, "bold"),
                 pady=5).pack(fill=tk.X)
         
-        self.events_listbox = tk.Listbox(events_frame,
-                                        bg=COLORS["input_bg"],
-                                        fg=COLORS["fg"],
-                                        selectbackground=COLORS["accent"],
-                                        borderwidth=0,
-                                        font=("Consolas", 9))
-        self.events_listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.events_view = EventListView(events_frame, self._format_event,
+                                         bg=COLORS["input_bg"],
+                                         fg=COLORS["fg"],
+                                         selectbackground=COLORS["accent"],
+                                         borderwidth=0,
+                                         font=("Consolas", 9))
+        self.events_view.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.events_listbox = self.events_view.listbox
+        self._refresh_job = None
         
         # ========== MINIMAL LOG AREA ==========
         log_frame = tk.Frame(self.main_tab, bg=COLORS["card"], bd=1, relief="solid")
@@ -1199,14 +3699,16 @@ class MacroFlowMiniApp:
                 font=("Segoe UI", 10, "bold"),
                 pady=3).pack(fill=tk.X)
         
-        self.log_box = scrolledtext.ScrolledText(log_frame,
-                                                height=4,
-                                                bg=COLORS["input_bg"],
-                                                fg=COLORS["fg"],
-                                                insertbackground=COLORS["fg"],
-                                                borderwidth=0,
-                                                font=("Consolas", 8))
-        self.log_box.pack(fill=tk.X, padx=5, pady=5)
+        self.log_view = LogView(log_frame,
+                                height=4,
+                                bg=COLORS["input_bg"],
+                                fg=COLORS["fg"],
+                                insertbackground=COLORS["fg"],
+                                borderwidth=0,
+                                font=("Consolas", 8))
+        self.log_view.pack(fill=tk.X, padx=5, pady=5)
+        self.log_box = self.log_view.text
+        self.ui_bus.log_widget = self.log_view
         
         # ========== SETTINGS TAB CONTENT ==========
         settings_header = tk.Frame(self.settings_tab, bg=COLORS["bg"])
@@ -1285,6 +3787,15 @@ class MacroFlowMiniApp:
         tk.Label(row4, text="(Default: F10)", bg=COLORS["card"], fg=COLORS["secondary"],
                 font=("Segoe UI", 9)).pack(side=tk.LEFT)
         
+        # Dopasowanie szablonów w skali szarości
+        row5 = tk.Frame(hotkey_grid, bg=COLORS["card"])
+        row5.pack(fill=tk.X, pady=5)
+        self.grayscale_var = tk.BooleanVar(value=GRAYSCALE_MATCHING)
+        tk.Checkbutton(row5, text="Grayscale template matching", variable=self.grayscale_var,
+                      command=self._apply_grayscale, bg=COLORS["card"], fg=COLORS["fg"],
+                      selectcolor=COLORS["input_bg"], activebackground=COLORS["card"],
+                      activeforeground=COLORS["fg"], font=("Segoe UI", 10)).pack(side=tk.LEFT)
+        
         # Save Settings Button
         button_frame = tk.Frame(hotkey_frame, bg=COLORS["card"])
         button_frame.pack(fill=tk.X, pady=20)
@@ -1735,7 +4246,7 @@ Enjoy automating with MacroFlow Mini! 🚀
         try:
             settings_file = os.path.join(APP_DATA_DIR, "macroflow_settings.json")
             with open(settings_file, "w") as f:
-                json.dump(HOTKEYS, f, indent=2)
+                json.dump(dict(HOTKEYS, grayscale_matching=GRAYSCALE_MATCHING), f, indent=2)
             self.log(f"Settings saved successfully to {settings_file}")
             messagebox.showinfo("Success", f"Settings saved to {settings_file}")
         except Exception as e:
@@ -1747,8 +4258,15 @@ Enjoy automating with MacroFlow Mini! 🚀
         self.stop_record_var.set("F4")
         self.start_play_var.set("F8")
         self.stop_play_var.set("F10")
+        self.grayscale_var.set(False)
+        self._apply_grayscale()
         self.log("Settings reset to defaults")
 
+    def _apply_grayscale(self):
+        """Włącz/wyłącz dopasowanie szablonów w skali szarości"""
+        global GRAYSCALE_MATCHING
+        GRAYSCALE_MATCHING = bool(self.grayscale_var.get())
+
     def load_settings(self):
         """Wczytaj ustawienia z pliku"""
         global HOTKEYS
@@ -1760,11 +4278,13 @@ Enjoy automating with MacroFlow Mini! 🚀
             if os.path.exists(settings_file_app):
                 with open(settings_file_app, "r") as f:
                     saved_settings = json.load(f)
+                    self.grayscale_var.set(saved_settings.pop("grayscale_matching", False))
                     HOTKEYS.update(saved_settings)
                     self.log(f"Loaded settings from {settings_file_app}")
             elif os.path.exists(settings_file_local):
                 with open(settings_file_local, "r") as f:
                     saved_settings = json.load(f)
+                    self.grayscale_var.set(saved_settings.pop("grayscale_matching", False))
                     HOTKEYS.update(saved_settings)
                     self.log(f"Loaded settings from {settings_file_local}")
             
@@ -1773,6 +4293,7 @@ Enjoy automating with MacroFlow Mini! 🚀
             self.stop_record_var.set(HOTKEYS.get("stop_record", "F4"))
             self.start_play_var.set(HOTKEYS.get("start_play", "F8"))
             self.stop_play_var.set(HOTKEYS.get("stop_play", "F10"))
+            self._apply_grayscale()
             
         except Exception as e:
             self.log(f"Failed to load settings: {str(e)}")
@@ -1808,25 +4329,31 @@ Enjoy automating with MacroFlow Mini! 🚀
 
     def log(self, text):
         logging.info(text)
-        self.log_box.insert(tk.END, f"{datetime.now().strftime('%H:%M:%S')} - {text}\n")
-        self.log_box.see(tk.END)
+        self.ui_bus.log(f"{datetime.now().strftime('%H:%M:%S')} - {text}\n")
+
+    @staticmethod
+    def _format_event(i, e):
+        if e["type"] == "click":
+            return f"{i}: CLICK pos={e['pos']}"
+        elif e["type"] == "drag":
+            return f"{i}: DRAG {e['start']}->{e['end']}"
+        elif e["type"] == "key_press":
+            return f"{i}: KEY PRESS: {e['key']}"
+        elif e["type"] == "key_release":
+            return f"{i}: KEY RELEASE: {e['key']}"
+        return f"{i}: {e['type'].upper()}"
 
     def _refresh_ui(self):
+        """Zsynchronizuj listę zdarzeń; odpytuje tylko podczas nagrywania"""
+        if self._refresh_job is not None:
+            self.root.after_cancel(self._refresh_job)
+            self._refresh_job = None
         try:
-            # events
-            self.events_listbox.delete(0, tk.END)
-            for i, e in enumerate(events):
-                if e["type"] == "click":
-                    self.events_listbox.insert(tk.END, f"{i}: CLICK pos={e['pos']}")
-                elif e["type"] == "drag":
-                    self.events_listbox.insert(tk.END, f"{i}: DRAG {e['start']}->{e['end']}")
-                elif e["type"] == "key_press":
-                    self.events_listbox.insert(tk.END, f"{i}: KEY PRESS: {e['key']}")
-                elif e["type"] == "key_release":
-                    self.events_listbox.insert(tk.END, f"{i}: KEY RELEASE: {e['key']}")
+            self.events_view.sync(events)
         except Exception:
             pass
-        self.root.after(400, self._refresh_ui)
+        if recording:
+            self._refresh_job = self.root.after(400, self._refresh_ui)
 
     def start_record(self):
         global recording, events, last_event_time
@@ -1837,6 +4364,8 @@ Enjoy automating with MacroFlow Mini! 🚀
             return
         
         events.clear()
+        self._set_compacting(None)
+        self._start_journal(events)
         recording = True
         last_event_time = None
         
@@ -1859,6 +4388,8 @@ Enjoy automating with MacroFlow Mini! 🚀
             options.append("Mouse")
         
         self.log(f"Recording started (Hotkey: {HOTKEYS['start_record']}) - Recording: {', '.join(options)}")
+        # Odświeżaj listę zdarzeń podczas nagrywania
+        self._refresh_ui()
 
     def stop_record(self):
         global recording
@@ -1872,12 +4403,150 @@ Enjoy automating with MacroFlow Mini! 🚀
         if compact_mode and self.compact_window:
             self.compact_window.update_status("Ready")
         self.log(f"Recording stopped; events={len(events)} (Hotkey: {HOTKEYS['stop_record']})")
+        self._finish_journal(events, self._adopt_recording)
+        self._refresh_ui()
+
+    def _start_journal(self, evts, suffix=""):
+        """Stream the recording in `evts` to a journal if "Stream to disk" is on"""
+        if not self.journal_var.get():
+            return
+        journal = RecordingJournal(new_journal_path(suffix), "A" if suffix == "_a" else "B")
+        evts.attach_journal(journal)
+        self.log(f"Streaming recording to {journal.fname}")
+
+    def _finish_journal(self, evts, adopt):
+        """Close the recording's journal and compact it on the writer thread.
+
+        `adopt(path)` runs on the Tk thread once the compacted file exists.
+        Returns False if the recording was not journaled.
+        """
+        journal = evts.detach_journal()
+        if journal is None:
+            return False
+        out = os.path.splitext(journal.fname)[0] + MFB_EXTENSION
+        # `evts` holds only the journal tail until the compacted file is adopted
+        self._set_compacting(out)
+
+        def on_done(path, error):
+            if error is None:
+                self.ui_bus.call(adopt, path)
+            else:
+                self.ui_bus.call(self._compaction_failed, journal.fname, path, error)
+
+        self.log(f"Recording journaled: {journal.count} events; compacting to {out}")
+        self.writer.submit(out, lambda path: compact_journal(journal.close(), path),
+                           label=f"{journal.count} journaled events to {out}", on_done=on_done)
+        return True
+
+    def _adopt_recording(self, path):
+        """Podmień ogon nagrania z dziennika na skompaktowany plik"""
+        global events
+        if recording or path != self.compacting:
+            self.log(f"Recording saved to {path} (not loaded: a newer recording replaced it)")
+            return
+        try:
+            data = EventList(read_macro(path))
+        except Exception as e:
+            logging.exception(f"Could not load compacted recording {path}")
+            self.log(f"Could not load compacted recording {path}: {e}")
+            messagebox.showerror("Recording not loaded",
+                                 f"Could not load the compacted recording:\n{e}\n\n"
+                                 f"Load {path} to get the full recording back.")
+            return
+        events = data
+        self._set_compacting(None)
+        threading.Thread(target=playback_plan, args=(events.copy(),), daemon=True).start()
+        self.log(f"Loaded {len(data)} recorded events from {path}")
+        self._refresh_ui()
+
+    def start_calibration(self):
+        """Measure input injection cost on a background thread and store the profile"""
+        if playing or recording:
+            self.log("Stop playback and recording before calibrating input")
+            return
+        self.calibrate_btn.config(state=tk.DISABLED)
+        self.log("Calibrating input: the pointer moves by one pixel, keep the mouse still")
+
+        def run():
+            try:
+                profile = calibrate_input()
+                self.log(f"Input calibrated ({input_backend_id()}): move {profile.move_s * 1000:.2f} ms "
+                         f"per call; saved to {INPUT_PROFILE_FILE}")
+            except Exception as e:
+                logging.exception("Input calibration failed")
+                self.log(f"Input calibration failed: {e}")
+            finally:
+                self.ui_bus.call(self.calibrate_btn.config, {"state": tk.NORMAL})
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _compaction_failed(self, journal_fname, path, error):
+        """Compaction of a journal failed: the journal stays on disk for recovery"""
+        logging.error(f"Compacting {journal_fname} to {path} failed: {error}")
+        self.log(f"Compacting the recording failed: {error}; journal kept at {journal_fname}")
+        if path != self.compacting:
+            return
+        messagebox.showerror("Recording not saved",
+                             f"Compacting the recording failed:\n{error}\n\n"
+                             f"Only the last events are in memory. The full recording "
+                             f"is kept in {journal_fname}; load it to recover.")
+
+    def _set_compacting(self, path):
+        """Disable Play/Save while the events are waiting for compacted `path`"""
+        self.compacting = path
+        state = tk.DISABLED if path else tk.NORMAL
+        self.play_start_btn.config(state=state)
+        self.save_btn.config(state=state)
+
+    def _compaction_pending(self, action):
+        """True (and logged) if `action` must wait for a journal compaction"""
+        if self.compacting is None:
+            return False
+        self.log(f"{action} is disabled until the recording is loaded from {self.compacting}")
+        return True
+
+    def _add_setting(self, parent, text, default):
+        """Labelled entry row in the settings panel; returns the Entry"""
+        row = tk.Frame(parent, bg=COLORS["bg"])
+        row.pack(fill=tk.X, pady=2)
+        tk.Label(row,
+                text=text,
+                bg=COLORS["bg"],
+                fg=COLORS["fg"],
+                font=("Segoe UI", 9),
+                width=15,
+                anchor=tk.W).pack(side=tk.LEFT)
+        entry = tk.Entry(row,
+                         width=8,
+                         bg=COLORS["input_bg"],
+                         fg=COLORS["fg"],
+                         insertbackground=COLORS["fg"],
+                         borderwidth=1,
+                         font=("Segoe UI", 9))
+        entry.insert(0, default)
+        entry.pack(side=tk.LEFT, padx=5)
+        return entry
+
+    def _read_timing(self):
+        """PlaybackTiming from the settings entries; invalid input resets them to 1x"""
+        try:
+            return playback_timing(self.speed_entry.get(), self.max_gap_entry.get() or 0,
+                                   self.drag_speed_entry.get())
+        except ValueError:
+            for entry, default in ((self.speed_entry, "1.0"), (self.max_gap_entry, "0"),
+                                   (self.drag_speed_entry, "1.0")):
+                entry.delete(0, tk.END)
+                entry.insert(0, default)
+            self.log("Invalid playback timing; using normal speed")
+            return NORMAL_TIMING
 
     def start_play(self):
         global playing, _playback_thread
         if playing:
             self.log("Already playing")
             return
+        if self._compaction_pending("Playback"):
+            return
         try:
             delay = int(self.delay_entry.get())
         except Exception:
@@ -1886,10 +4555,11 @@ Enjoy automating with MacroFlow Mini! 🚀
             repeat = int(self.repeat_entry.get())
         except Exception:
             repeat = 0
+        timing = self._read_timing()
         playing = True
-        playback_worker.running = True
+        cancel = begin_playback()
         _playback_thread = threading.Thread(target=playback_worker, 
-                                           args=(delay, repeat, self.status_label, self.log), 
+                                           args=(delay, repeat, self.ui_bus.label(self.status_label), self.log, timing, cancel), 
                                            daemon=True)
         _playback_thread.start()
         self.status_label.config(text="Status: Playing...")
@@ -1899,7 +4569,7 @@ Enjoy automating with MacroFlow Mini! 🚀
         self.log(f"Playback started (Hotkey: {HOTKEYS['start_play']})")
 
     def stop_play(self):
-        playback_worker.running = False
+        stop_playback()
         global playing
         playing = False
         self.status_label.config(text="Status: Ready")
@@ -1909,6 +4579,8 @@ Enjoy automating with MacroFlow Mini! 🚀
         self.log(f"Playback stopped (Hotkey: {HOTKEYS['stop_play']})")
 
     def save_file(self):
+        if self._compaction_pending("Saving"):
+            return
         # Domyślnie zapisuj w katalogu danych aplikacji
         default_dir = APP_DATA_DIR
         default_file = os.path.join(default_dir, DATA_FILE)
@@ -1916,23 +4588,18 @@ Enjoy automating with MacroFlow Mini! 🚀
         fname = filedialog.asksaveasfilename(
             defaultextension=".json", 
             initialfile=os.path.basename(default_file),
-            initialdir=default_dir
+            initialdir=default_dir,
+            filetypes=[("JSON", "*.json"), ("MacroFlow binary", "*.mfb"),
+                       ("MacroFlow bundle (with templates)", "*.mfz"), ("All", "*.*")]
         )
         if not fname:
             return
-        export = []
-        for e in events:
-            ee = dict(e)
-            # Usuwamy template z zapisu
-            if "template" in ee:
-                del ee["template"]
-            export.append(ee)
-        try:
-            with open(fname, "w", encoding="utf-8") as fh:
-                json.dump(export, fh, indent=2)
-            self.log(f"Saved events to {fname}")
-        except Exception as e:
-            messagebox.showerror("Save error", str(e))
+        def on_done(path, error):
+            if error is not None:
+                self.ui_bus.call(messagebox.showerror, "Save error", str(error))
+        
+        # write_macro usuwa template z zapisu (poza paczką .mfz)
+        self.writer.save_events(fname, events, on_done=on_done)
 
     def load_file(self):
         # Zacznij od katalogu danych aplikacji
@@ -1940,21 +4607,29 @@ Enjoy automating with MacroFlow Mini! 🚀
         
         fname = filedialog.askopenfilename(
             initialdir=initial_dir,
-            filetypes=[("JSON", "*.json"), ("All", "*.*")]
+            filetypes=[("Macros", "*.json *.mfb *.mfz *.mfj"), ("JSON", "*.json"),
+                       ("MacroFlow binary", "*.mfb"), ("MacroFlow bundle", "*.mfz"),
+                       ("Recording journal", "*.mfj"), ("All", "*.*")]
         )
         if not fname:
             return
         try:
-            with open(fname, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
+            data = read_macro(fname)
             global events
-            events = data
+            events = EventList(data)
+            self._set_compacting(None)
+            # compile now so templates are decoded before playback starts
+            threading.Thread(target=playback_plan, args=(events.copy(),), daemon=True).start()
             self.log(f"Loaded events from {fname}")
         except Exception as e:
             messagebox.showerror("Load error", str(e))
+        self._refresh_ui()
 
     def on_close(self):
         """Zamknij aplikację całkowicie"""
+        if not self.writer.wait(SAVE_WAIT_TIMEOUT):
+            logging.warning(f"Closing with {self.writer.pending()} save(s) still running")
+        self.ui_bus.stop()
         try:
             self.k_listener.stop()
         except Exception:
@@ -1966,7 +4641,7 @@ Enjoy automating with MacroFlow Mini! 🚀
         # Stop keyboard recording if active
         self.stop_keyboard_recording()
         
-        playback_worker.running = False
+        stop_playback()
         if hasattr(self, 'tray_icon') and self.tray_icon:
             self.tray_icon.stop()
         if self.compact_window:
@@ -1979,7 +4654,17 @@ Enjoy automating with MacroFlow Mini! 🚀
 # -----------------------
 def main():
     global APP
+    STARTUP_TIMER.mark("module")
+    setup_logging()
+    # ensure template dir exists - UŻYJ POPRAWNEJ ŚCIEŻKI
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    STARTUP_TIMER.mark("logging")
+    load_gui_modules()
+    STARTUP_TIMER.mark("tkinter")
+    print_config_banner()
     APP = MacroFlowMiniApp()
+    STARTUP_TIMER.mark("app")
+    APP.root.after_idle(STARTUP_TIMER.report, "window")
     APP.root.mainloop()
 
 if __name__ == "__main__":